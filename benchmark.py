@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Offline benchmarks for the pure pipeline stages (no browser, no network, Telegram stubbed).
+
+Usage:
+  python benchmark.py                          # run at 10, 100, 1k, 10k events, compare to baseline
+  python benchmark.py --sizes 100 1000         # custom sizes
+  python benchmark.py --payload response.json  # scale a recorded search-API response instead of synthetic data
+  python benchmark.py --save-baseline          # store this run as the baseline
+  python benchmark.py --fail-on-regression     # exit 1 if any stage is slower than the baseline allows
+
+Each stage is timed (best of --repeat runs) and its peak Python memory measured with tracemalloc.
+All state files are written to a temporary directory, never to data/.
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import config
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+DEFAULT_BASELINE = os.path.join(config.DATA_DIR, 'benchmark_baseline.json')
+
+_TITLES = [
+    "Золушка", "Три поросёнка", "Буратино", "Снежная королева", "Кот в сапогах",
+    "Маленький принц", "Щелкунчик", "Колобок", "Теремок", "Бременские музыканты",
+    "Аленький цветочек", "Дюймовочка", "Морозко", "Гуси-лебеди", "Красная Шапочка",
+]
+_HALLS = [
+    ("Большой зал", "ул. Энгельса, 20"),
+    ("Малый зал", "ул. Энгельса, 20"),
+    ("Камерная сцена", "пр. Независимости, 44"),
+]
+
+
+def synthetic_payload(n: int, seed: int = 42) -> dict:
+    """A search-API-shaped response with n events: contiguous bk_ids, repeated titles/halls/dates."""
+    rng = random.Random(seed)
+    start = datetime(2026, 3, 1)
+    events = []
+    for i in range(n):
+        hall, address = rng.choice(_HALLS)
+        when = start + timedelta(days=i // 6, hours=rng.choice([11, 13, 15, 18]))
+        events.append({
+            'bk_id': 4000 + i,
+            'server_key': config.TCE_BASE_PARAM,
+            'show_name': rng.choice(_TITLES),
+            'bk_date': when.strftime('%Y-%m-%d %H:%M:%S'),
+            'hall_name': hall,
+            'hall_address': address,
+            'owner_name': 'Белорусский государственный театр кукол',
+        })
+    return {'data': events, 'success': True}
+
+
+def scaled_payload(recorded: dict, n: int, extract) -> dict:
+    """Repeat a recorded response's events until there are n of them, renumbering bk_ids."""
+    source = extract(recorded)
+    if not source:
+        raise SystemExit("Recorded payload contains no events")
+    events = []
+    for i in range(n):
+        e = copy.deepcopy(source[i % len(source)])
+        e['bk_id'] = 4000 + i
+        events.append(e)
+    return {'data': events, 'success': True}
+
+
+def measure(fn, repeat: int):
+    """Best wall time (seconds) over `repeat` runs, and peak traced memory (bytes) of one run."""
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def run_stages(tce, payload: dict, workdir: str, repeat: int) -> dict:
+    """Time every pipeline stage against one payload. Returns {stage: {'seconds', 'peak_bytes'}}."""
+    theatre = tce.load_theatres()[0]
+    api_events = tce._extract_event_list(payload)
+    built = [tce._build_event_from_api(e, theatre) for e in api_events]
+    # Half of the IDs already processed: the diff sees a realistic mix of old and new
+    processed = tce.IdRangeSet(e['bk_id'] for e in api_events[: len(api_events) // 2])
+    ids_file = os.path.join(workdir, 'processed_ids.json')
+    tce.save_processed_ids(processed, ids_file)
+    # One window per month of shows; the index knows the processed half, with every tenth
+    # hash stale (a change) and one unreturned show per window (a removal)
+    by_month = {}
+    for e in api_events:
+        by_month.setdefault(str(e.get('bk_date', ''))[:7], []).append(e)
+    windows = [{'date_begin': f"{m}-01", 'date_end': f"{m}-31", 'events': events}
+               for m, events in sorted(by_month.items())]
+    index = {str(e['bk_id']): tce._index_entry(e) for e in api_events[: len(api_events) // 2]}
+    for key in list(index)[::10]:
+        index[key] = ['stale'] + index[key][1:]
+    for i, w in enumerate(windows):
+        index[f"gone-{i}"] = tce._index_entry({**w['events'][0], 'bk_id': f"gone-{i}"})
+    today = datetime.strptime(min(str(e.get('bk_date', '')) for e in api_events)[:10], '%Y-%m-%d').date()
+
+    def store_writes():
+        config.TCE_EVENTS_DB = os.path.join(workdir, f"events-{time.perf_counter_ns()}.sqlite3")
+        tce.save_tce_events(built)
+
+    def single_writes():
+        config.TCE_EVENTS_DB = os.path.join(workdir, f"single-{time.perf_counter_ns()}.sqlite3")
+        for event in built[:100]:
+            tce.save_single_tce_event(event)
+
+    stages = {
+        'extract_event_list': lambda: tce._extract_event_list(payload),
+        'build_event_from_api': lambda: [tce._build_event_from_api(e, theatre) for e in api_events],
+        'normalise_events': lambda: [r.to_dict() for r in tce.normalise_events(api_events, theatre)],
+        'classify_events': lambda: tce._classify_events(windows, dict(index), tce.load_processed_ids(ids_file),
+                                                        today=today),
+        'save_tce_events': store_writes,
+        'save_single_tce_event_x100': single_writes,
+        'save_tce_data': lambda: tce.save_tce_data(built),
+        'load_processed_ids': lambda: tce.load_processed_ids(ids_file),
+        'save_processed_ids': lambda: tce.save_processed_ids(processed | {e['bk_id'] for e in api_events},
+                                                             ids_file),
+        'notify_tce_events': lambda: tce.notify_tce_events(built),
+    }
+    results = {}
+    for name, fn in stages.items():
+        seconds, peak = measure(fn, repeat)
+        results[name] = {'seconds': seconds, 'peak_bytes': peak}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the TCE monitor pipeline')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Event counts to benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage (best is kept)')
+    parser.add_argument('--payload', help='Recorded search-API response (JSON) to scale instead of synthetic data')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline file (default: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the baseline')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='Slowdown ratio vs baseline reported as a regression (default: 1.25)')
+    parser.add_argument('--min-ms', type=float, default=1.0,
+                        help='Ignore regressions in stages faster than this many ms (timer noise)')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit 1 when a regression is found')
+    parser.add_argument('--json', dest='json_out', help='Also write results to this JSON file')
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.CRITICAL)  # stage log lines would dominate the timings
+
+    workdir = tempfile.mkdtemp(prefix='tce-bench-')
+    config.DATA_DIR = workdir
+    config.TCE_DATA_FILE = os.path.join(workdir, 'tce_events.json')
+    config.TCE_THEATRES_FILE = os.path.join(workdir, 'no-theatres.json')
+
+    import tce_monitor as tce
+    # Telegram stubbed out: message building and packing still run in full
+    tce.send_channel_post = lambda *a, **k: True
+
+    recorded = None
+    if args.payload:
+        with open(args.payload, 'r', encoding='utf-8') as f:
+            recorded = json.load(f)
+
+    results = {}
+    for n in args.sizes:
+        payload = scaled_payload(recorded, n, tce._extract_event_list) if recorded else synthetic_payload(n)
+        results[str(n)] = run_stages(tce, payload, workdir, args.repeat)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('results', {})
+
+    regressions = []
+    print(f"{'events':>7}  {'stage':<28} {'time ms':>10} {'peak KiB':>10} {'vs base':>9}")
+    for n, stages in results.items():
+        for stage, r in stages.items():
+            base = baseline.get(n, {}).get(stage)
+            ratio = ''
+            if base and base['seconds'] > 0:
+                factor = r['seconds'] / base['seconds']
+                ratio = f"{factor:.2f}x"
+                if factor > args.threshold and r['seconds'] * 1000 >= args.min_ms:
+                    ratio += ' !'
+                    regressions.append((n, stage, factor))
+            print(f"{n:>7}  {stage:<28} {r['seconds'] * 1000:>10.2f} {r['peak_bytes'] / 1024:>10.1f} {ratio:>9}")
+
+    report = {'created_at': datetime.now().isoformat(), 'python': sys.version.split()[0], 'results': results}
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif not baseline:
+        print(f"\nNo baseline at {args.baseline} — run with --save-baseline to create one")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.2f}x:")
+        for n, stage, factor in regressions:
+            print(f"  {stage} @ {n} events: {factor:.2f}x slower")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Cold-start budget check for commands that do not need a browser.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter for each module,
+takes the best cumulative import time over --repeat runs and fails when a module exceeds
+the budget or pulls in a heavy dependency (Playwright, requests) at import time.
+
+Usage:
+  python check_import_time.py                         # default modules, 150 ms budget
+  python check_import_time.py --budget-ms 80 --repeat 5
+  python check_import_time.py --modules main metrics  # check specific modules
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Entry points and state-only modules; tce_fetch/telegram_client are expected to be heavy
+DEFAULT_MODULES = ['main', 'tce_monitor', 'manage_processed_ids', 'id_ranges', 'metrics']
+FORBIDDEN = ['playwright', 'requests', 'urllib3']
+
+_LINE_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)')
+
+
+def import_profile(module: str):
+    """Return (cumulative µs of `module`, set of every module imported) from one fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=BASE_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    cumulative, imported = None, set()
+    for line in result.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if not match:
+            continue
+        name = match.group(4)
+        imported.add(name)
+        if name == module and len(match.group(3)) <= 1:  # top level, not a nested import
+            cumulative = int(match.group(2))
+    return cumulative or 0, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check cold-start import time of non-fetch commands')
+    parser.add_argument('--modules', nargs='+', default=DEFAULT_MODULES, help='Modules to import')
+    parser.add_argument('--budget-ms', type=float, default=150.0, help='Per-module budget (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='Fresh interpreters per module (best is kept)')
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'module':<24} {'import ms':>10}  heavy deps")
+    for module in args.modules:
+        try:
+            runs = [import_profile(module) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            failures.append(str(e))
+            print(f"{module:<24} {'error':>10}")
+            continue
+        best_ms = min(us for us, _ in runs) / 1000.0
+        heavy = sorted({name.split('.')[0] for name in runs[0][1]} & set(FORBIDDEN))
+        flag = ' !' if best_ms > args.budget_ms or heavy else ''
+        print(f"{module:<24} {best_ms:>10.1f}  {', '.join(heavy) or '-'}{flag}")
+        if best_ms > args.budget_ms:
+            failures.append(f"{module}: {best_ms:.1f} ms exceeds the {args.budget_ms:.0f} ms budget")
+        if heavy:
+            failures.append(f"{module}: imports {', '.join(heavy)} at import time")
+
+    if failures:
+        print(f"\n{len(failures)} problem(s):")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print(f"\nAll modules within {args.budget_ms:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,140 @@
 import os
 from dotenv import load_dotenv
 
+load_dotenv()
+
 # Base dirs
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
 
 
-TCE_DATA_FILE = os.path.join(DATA_DIR, 'tce_events.json')
+TCE_DATA_FILE = os.path.join(DATA_DIR, 'tce_events.json')  # legacy; migrated into TCE_EVENTS_DB
+TCE_EVENTS_DB = os.path.join(DATA_DIR, 'tce_events.sqlite3')
+TCE_SNAPSHOTS_DB = os.path.join(DATA_DIR, 'tce_snapshots.sqlite3')
 TCE_PROCESSED_IDS_FILE = os.path.join(DATA_DIR, 'tce_processed_ids.json')
+TCE_SESSION_FILE = os.path.join(DATA_DIR, 'tce_session.json')
+TCE_WINDOW_PLAN_FILE = os.path.join(DATA_DIR, 'tce_window_plan.json')
+TCE_RESOURCE_SIZES_FILE = os.path.join(DATA_DIR, 'tce_resource_sizes.json')
 LOG_FILE = os.path.join(LOG_DIR, 'theater_monitor.log')
 
+# main.py logging: written by a background thread, rotated at LOG_MAX_BYTES (or on the
+# LOG_ROTATE_WHEN schedule, e.g. 'midnight') keeping LOG_BACKUP_COUNT files. LOG_FORMAT=json
+# writes JSON lines with run_id and phase fields.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')
+
+# Per-run metrics (phase timings + counters), rewritten after every run; set to '' to disable
+METRICS_REPORT_FILE = os.getenv('METRICS_REPORT_FILE', os.path.join(LOG_DIR, 'tce_run_report.json'))
+METRICS_PROM_FILE = os.getenv('METRICS_PROM_FILE', os.path.join(LOG_DIR, 'tce_monitor.prom'))
+
 # TCE.BY monitoring configuration
-TCE_BASE_URL = "https://tce.by/shows.html"
+# Site origin; override (e.g. TCE_ORIGIN=http://127.0.0.1:8765) to run against fake_tce_server.py
+TCE_ORIGIN = os.getenv('TCE_ORIGIN', 'https://tce.by').rstrip('/')
+TCE_BASE_URL = f"{TCE_ORIGIN}/shows.html"
 TCE_BASE_PARAM = "RkZDMTE2MUQtMTNFNy00NUIyLTg0QzYtMURDMjRBNTc1ODA0"
-TCE_SEARCH_API_URL = "https://tce.by/index.php?view=shows&action=find&kind=text"
+TCE_SEARCH_API_URL = f"{TCE_ORIGIN}/index.php?view=shows&action=find&kind=text"
 TCE_MONTHS_AHEAD = 4  # current month + 3 future months per run
+TCE_API_RESULT_CAP = 100  # search API silently truncates at this many results
 
-load_dotenv()
+# Optional list of theatres to monitor (see theatres.example.json). Without it only the
+# puppet theatre (TCE_BASE_PARAM) is monitored, using the Telegram settings below.
+TCE_THEATRES_FILE = os.getenv('TCE_THEATRES_FILE', os.path.join(BASE_DIR, 'theatres.json'))
+
+# Notify when an already-announced show changes date/time/hall/title, or disappears from the schedule
+TCE_NOTIFY_CHANGES = os.getenv('TCE_NOTIFY_CHANGES', 'true').lower() == 'true'
+TCE_NOTIFY_REMOVALS = os.getenv('TCE_NOTIFY_REMOVALS', 'false').lower() == 'true'
 
 # Production Telegram settings
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', 'default_dev_token')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID', 'default_dev_chat_id')
 TELEGRAM_CHANNEL_USERNAME = os.getenv('TELEGRAM_CHANNEL_USERNAME', 'default_dev_username')
 
+# Telegram delivery: Bot API base URL, connection pool, rate limits and retries.
+# Telegram allows ~30 messages/s per bot and ~20 messages/min per channel.
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '4'))
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))  # messages per second, all chats
+TELEGRAM_CHAT_RATE_PER_MIN = float(os.getenv('TELEGRAM_CHAT_RATE_PER_MIN', '20'))
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', '3'))
+TELEGRAM_MESSAGE_LIMIT = 4096  # characters after entity parsing, per sendMessage
+TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', '3'))
+TELEGRAM_BACKOFF_BASE = float(os.getenv('TELEGRAM_BACKOFF_BASE', '1.0'))  # seconds, doubled per retry
+
 # Test Telegram channel settings
 TEST_TELEGRAM_CHAT_ID = os.getenv('TEST_TELEGRAM_CHAT_ID', 'default_test_chat_id')
 TEST_TELEGRAM_CHANNEL_USERNAME = os.getenv('TEST_TELEGRAM_CHANNEL_USERNAME', 'default_test_username')
 
+# Notification outbox (in TCE_EVENTS_DB): a failed send is retried after TCE_OUTBOX_RETRY_BASE
+# seconds, doubled per attempt up to TCE_OUTBOX_RETRY_MAX, and given up after TCE_OUTBOX_MAX_ATTEMPTS.
+# Delivered items are forgotten after TCE_OUTBOX_RETENTION_DAYS.
+TCE_OUTBOX_MAX_ATTEMPTS = int(os.getenv('TCE_OUTBOX_MAX_ATTEMPTS', '10'))
+TCE_OUTBOX_RETRY_BASE = float(os.getenv('TCE_OUTBOX_RETRY_BASE', '60'))
+TCE_OUTBOX_RETRY_MAX = float(os.getenv('TCE_OUTBOX_RETRY_MAX', '3600'))
+TCE_OUTBOX_RETENTION_DAYS = float(os.getenv('TCE_OUTBOX_RETENTION_DAYS', '7'))
+TCE_OUTBOX_POLL_INTERVAL = float(os.getenv('TCE_OUTBOX_POLL_INTERVAL', '30'))  # daemon worker retry check, seconds
+# Store, queue and send each window's new events while later windows are still being fetched;
+# at most TCE_STREAM_QUEUE_SIZE fetched windows wait for the delivery stage. Off by default:
+# earlier alerts, but one send per window instead of one packed batch per run
+TCE_STREAM_NOTIFY = os.getenv('TCE_STREAM_NOTIFY', 'false').lower() == 'true'
+TCE_STREAM_QUEUE_SIZE = int(os.getenv('TCE_STREAM_QUEUE_SIZE', '4'))
+
+# Snapshot history (TCE_SNAPSHOTS_DB): every complete run's fetched set per theatre, stored as
+# the delta from the previous run; a run is also written in full once the deltas since the last
+# full one reach TCE_SNAPSHOT_CHECKPOINT_RATIO x the set size (lower = faster replay, more disk)
+TCE_SNAPSHOTS = os.getenv('TCE_SNAPSHOTS', 'true').lower() == 'true'
+TCE_SNAPSHOT_CHECKPOINT_RATIO = float(os.getenv('TCE_SNAPSHOT_CHECKPOINT_RATIO', '1.0'))
+
+# Optional posters: looked up once per show (API field or the show page's og:image, at most
+# TCE_POSTER_LOOKUPS_PER_RUN pages per run), downloaded by TCE_POSTER_WORKERS threads into a
+# content-addressed cache trimmed to TCE_POSTER_CACHE_MB, and sent after each 'new' alert
+TCE_POSTERS = os.getenv('TCE_POSTERS', 'false').lower() == 'true'
+TCE_POSTER_CACHE_DIR = os.getenv('TCE_POSTER_CACHE_DIR', os.path.join(DATA_DIR, 'posters'))
+TCE_POSTER_CACHE_MB = float(os.getenv('TCE_POSTER_CACHE_MB', '200'))
+TCE_POSTER_WORKERS = int(os.getenv('TCE_POSTER_WORKERS', '4'))
+TCE_POSTER_LOOKUPS_PER_RUN = int(os.getenv('TCE_POSTER_LOOKUPS_PER_RUN', '20'))
+
 # Browser automation settings for Anubis bypass
 USE_HEADLESS = os.getenv('USE_HEADLESS', 'true').lower() == 'true'
 BROWSER_TIMEOUT = int(os.getenv('BROWSER_TIMEOUT', '30'))
+# Full navigation waits for the clearance cookie (name containing TCE_CLEARANCE_COOKIE) or the
+# challenge page to disappear, confirmed by a probe POST; gives up after TCE_CLEARANCE_TIMEOUT s
+TCE_CLEARANCE_COOKIE = os.getenv('TCE_CLEARANCE_COOKIE', 'anubis-auth')
+TCE_CLEARANCE_TIMEOUT = int(os.getenv('TCE_CLEARANCE_TIMEOUT', '30'))
+# How long (seconds) a stored Anubis clearance is reused before forcing full navigation
+TCE_SESSION_TTL = int(os.getenv('TCE_SESSION_TTL', '86400'))
+
+# Playwright request routing during clearance: abort these resource types and (optionally)
+# every host other than the TCE_ORIGIN host and TCE_ALLOWED_HOSTS. Same-origin scripts are kept.
+TCE_RESOURCE_POLICY = os.getenv('TCE_RESOURCE_POLICY', 'true').lower() == 'true'
+TCE_BLOCK_RESOURCE_TYPES = [t.strip() for t in os.getenv('TCE_BLOCK_RESOURCE_TYPES', 'image,font,media').split(',')
+                            if t.strip()]
+TCE_BLOCK_THIRD_PARTY = os.getenv('TCE_BLOCK_THIRD_PARTY', 'true').lower() == 'true'
+TCE_ALLOWED_HOSTS = [h.strip() for h in os.getenv('TCE_ALLOWED_HOSTS', '').split(',') if h.strip()]
+
+# Opt-in parallel month POSTs inside the cleared page. Months after the first empty one
+# are still discarded, so results match sequential mode.
+TCE_CONCURRENT_FETCH = os.getenv('TCE_CONCURRENT_FETCH', 'false').lower() == 'true'
+TCE_FETCH_CONCURRENCY = int(os.getenv('TCE_FETCH_CONCURRENCY', '3'))
+TCE_FETCH_JITTER_MS = int(os.getenv('TCE_FETCH_JITTER_MS', '500'))  # max random delay before each POST
+
+# Adaptive date windows: split a window in half when it hits TCE_API_RESULT_CAP, merge
+# adjacent windows whose last counts fit within TCE_WINDOW_FILL_RATIO of the cap, and
+# remember the plan between runs. When disabled, calendar months are used (still split on cap).
+TCE_ADAPTIVE_WINDOWS = os.getenv('TCE_ADAPTIVE_WINDOWS', 'true').lower() == 'true'
+TCE_WINDOW_FILL_RATIO = float(os.getenv('TCE_WINDOW_FILL_RATIO', '0.6'))
+
+# Run checkpoint: windows fetched by a failed run are reused for TCE_CHECKPOINT_TTL seconds,
+# so a re-run only fetches the rest. Diff/notify/persist wait for complete coverage unless
+# TCE_ALLOW_PARTIAL (or main.py --allow-partial) is set.
+TCE_CHECKPOINT_TTL = int(os.getenv('TCE_CHECKPOINT_TTL', '1800'))
+TCE_ALLOW_PARTIAL = os.getenv('TCE_ALLOW_PARTIAL', 'false').lower() == 'true'
+
+# Daemon mode (main.py --daemon): rebuild the warm browser after this many polls
+DAEMON_MAX_CYCLES = int(os.getenv('DAEMON_MAX_CYCLES', '48'))
 
 # Shared HTTP fingerprint constants — keep in sync with actual Chrome release
 USER_AGENT = (
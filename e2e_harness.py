@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""End-to-end harness: the real check_for_new_tce_events against fake_tce_server.py.
+
+Starts the fake tce.by + Telegram server on a free port, points TCE_ORIGIN and
+TELEGRAM_API_URL at it, keeps all state in a temporary directory and runs the full
+pipeline (Chromium, clearance, window fetches, diff, store, Telegram) several times,
+adding new shows between runs.
+
+Usage:
+  python e2e_harness.py                                   # 5 runs, fresh browser each run
+  python e2e_harness.py --runs 20 --reuse-session         # daemon-style warm browser
+  python e2e_harness.py --tail-ms 3000 --tail-rate 0.1 --error-rate 0.05 --telegram-429-rate 0.2
+  python e2e_harness.py --concurrent --json report.json
+  python e2e_harness.py --posters                         # also look up, download and send posters
+
+Reports per-run latency (p50/p95/max), failures, events found vs. missed and Telegram traffic
+(with --posters also show-page lookups, poster downloads and uploads, which must not repeat).
+Needs Playwright + Chromium, but no network access.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_tce_server import FakeTceServer, add_state_arguments, state_from_args
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the monitor end-to-end against a local fake tce.by')
+    parser.add_argument('--runs', type=int, default=5, help='Pipeline runs (default: %(default)s)')
+    parser.add_argument('--add-per-run', type=int, default=5, help='New shows added before each later run')
+    parser.add_argument('--reuse-session', action='store_true', help='Keep one warm browser across runs')
+    parser.add_argument('--concurrent', action='store_true', help='Enable TCE_CONCURRENT_FETCH')
+    parser.add_argument('--no-notify', action='store_true', help='Skip Telegram sends')
+    parser.add_argument('--posters', action='store_true', help='Enable TCE_POSTERS (show pages, downloads, albums)')
+    parser.add_argument('--verbose', action='store_true', help='Show the monitor log')
+    parser.add_argument('--json', dest='json_out', help='Also write the report to this JSON file')
+    add_state_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    state = state_from_args(args, server_key=None)
+    server = FakeTceServer(state).start()
+
+    # config reads these at import time, so set them before anything imports it
+    os.environ['TCE_ORIGIN'] = server.url
+    os.environ['TELEGRAM_API_URL'] = server.url
+    import config
+    state.server_key = config.TCE_BASE_PARAM
+    for event in state.events:
+        event['server_key'] = config.TCE_BASE_PARAM
+
+    workdir = tempfile.mkdtemp(prefix='tce-e2e-')
+    config.DATA_DIR = workdir
+    config.TCE_DATA_FILE = os.path.join(workdir, 'tce_events.json')
+    config.TCE_EVENTS_DB = os.path.join(workdir, 'tce_events.sqlite3')
+    config.TCE_PROCESSED_IDS_FILE = os.path.join(workdir, 'tce_processed_ids.json')
+    config.TCE_SESSION_FILE = os.path.join(workdir, 'tce_session.json')
+    config.TCE_WINDOW_PLAN_FILE = os.path.join(workdir, 'tce_window_plan.json')
+    config.TCE_POSTER_CACHE_DIR = os.path.join(workdir, 'posters')
+    config.TCE_SNAPSHOTS_DB = os.path.join(workdir, 'tce_snapshots.sqlite3')
+    config.TCE_THEATRES_FILE = os.path.join(workdir, 'no-theatres.json')
+    config.METRICS_REPORT_FILE = os.path.join(workdir, 'tce_run_report.json')
+    config.METRICS_PROM_FILE = os.path.join(workdir, 'tce_monitor.prom')
+    config.TCE_CONCURRENT_FETCH = args.concurrent
+    config.TCE_POSTERS = args.posters
+
+    import tce_monitor as tce
+    from telegram_client import get_telegram_client
+    session = tce.TceBrowserSession() if args.reuse_session else None
+
+    runs = []
+    try:
+        for i in range(args.runs):
+            if i > 0 and args.add_per_run:
+                state.add_events(args.add_per_run)
+            before = state.stats()['counters']
+            started = time.perf_counter()
+            error = None
+            found = 0
+            try:
+                found = len(tce.check_for_new_tce_events(notify=not args.no_notify, session=session))
+            except Exception as e:
+                error = str(e)
+                if session is not None:
+                    session.close()
+            elapsed = time.perf_counter() - started
+            after = state.stats()['counters']
+            run = {'run': i + 1, 'seconds': elapsed, 'new_events': found, 'error': error,
+                   'requests': {k: after[k] - before[k] for k in after},
+                   'phases': tce.metrics.current().summary()}
+            runs.append(run)
+            status = f"FAILED: {error}" if error else f"{found} new"
+            print(f"run {i + 1:>3}: {elapsed:7.2f}s  {status}  "
+                  f"search POSTs={run['requests']['search_api']} challenges={run['requests']['challenge']}")
+    finally:
+        if session is not None:
+            session.close()
+        server.stop()
+
+    # Every show inside the monitored horizon should have been picked up by the last run
+    horizon_end = tce._build_month_windows()[-1]['date_end']
+    processed = tce.load_processed_ids()
+    expected = [e for e in state.events if e['bk_date'][:10] <= horizon_end]
+    missed = [e['bk_id'] for e in expected if e['bk_id'] not in processed]
+    # Each title's poster is downloaded and uploaded once; later sends reuse its file_id
+    titles = len({e['show_name'] for e in state.events})
+
+    latencies = [r['seconds'] for r in runs if not r['error']]
+    stats = state.stats()
+    report = {
+        'runs': runs,
+        'latency': {'p50': _percentile(latencies, 50), 'p95': _percentile(latencies, 95),
+                    'max': max(latencies, default=0.0)},
+        'failures': sum(1 for r in runs if r['error']),
+        'events_served': len(expected),
+        'events_missed': len(missed),
+        'server': stats['counters'],
+        'telegram_messages': len(stats['messages']),
+        'telegram_client': get_telegram_client().summary(),
+        'workdir': workdir,
+    }
+
+    print(f"\nlatency p50={report['latency']['p50']:.2f}s p95={report['latency']['p95']:.2f}s "
+          f"max={report['latency']['max']:.2f}s  failures={report['failures']}/{len(runs)}")
+    print(f"events in horizon={len(expected)} missed={len(missed)}"
+          + (f" (first: {missed[:10]})" if missed else ''))
+    print(f"telegram: {report['telegram_messages']} message(s) delivered, "
+          f"{stats['counters']['telegram_429']} rate-limited, client {report['telegram_client']}")
+    poster_repeats = args.posters and not args.no_notify and (
+        stats['counters']['poster_image'] > titles or stats['counters']['telegram_uploads'] > titles)
+    if args.posters:
+        print(f"posters: {stats['counters']['show_page']} show page(s), {stats['counters']['poster_image']} "
+              f"download(s), {stats['counters']['telegram_uploads']} upload(s) for {titles} title(s)"
+              + (" — posters fetched or uploaded more than once" if poster_repeats else ''))
+    print(f"server counters: {stats['counters']}")
+    print(f"state kept in {workdir}")
+
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    sys.exit(1 if report['failures'] or missed or poster_repeats else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""Indexed SQLite store for TCE events (replaces rewriting tce_events.json per event) and the notification outbox"""
+import json
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id        TEXT PRIMARY KEY,
+    theatre   TEXT,
+    starts_at TEXT,
+    hall      TEXT,
+    hall_key  TEXT,
+    title     TEXT,
+    found_at  TEXT,
+    data      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_starts_at ON events (starts_at);
+CREATE INDEX IF NOT EXISTS idx_events_found_at ON events (found_at);
+
+CREATE TABLE IF NOT EXISTS outbox (
+    seq             INTEGER PRIMARY KEY AUTOINCREMENT,
+    key             TEXT NOT NULL UNIQUE,
+    chat_id         TEXT NOT NULL,
+    kind            TEXT NOT NULL,
+    theatre         TEXT,
+    prefix          TEXT NOT NULL DEFAULT '',
+    channel         TEXT,
+    event           TEXT NOT NULL,
+    status          TEXT NOT NULL DEFAULT 'pending',
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error      TEXT,
+    created_at      REAL NOT NULL,
+    sent_at         REAL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, next_attempt_at);
+"""
+
+
+def _starts_at(event: dict):
+    """Sortable 'YYYY-MM-DD HH:MM' from the event's dd.mm.yyyy date and HH:MM time, or None."""
+    try:
+        d = datetime.strptime(event.get('date', ''), '%d.%m.%Y')
+    except (ValueError, TypeError):
+        return None
+    t = event.get('time')
+    return d.strftime('%Y-%m-%d') + (f" {t}" if t and t != 'Unknown' else '')
+
+
+def _hall_key(hall):
+    """Case- and whitespace-insensitive hall name; --hall matches it by prefix."""
+    return ' '.join(hall.casefold().split()) if isinstance(hall, str) else None
+
+
+def _row(event: dict) -> tuple:
+    return (
+        str(event['id']),
+        event.get('theatre'),
+        _starts_at(event),
+        event.get('venue'),
+        _hall_key(event.get('venue')),
+        event.get('title'),
+        event.get('found_at'),
+        json.dumps(event, ensure_ascii=False),
+    )
+
+
+class EventStore:
+    """
+    Events keyed by id with an index on show start time.
+    Writes are batched: add_many() inserts a whole run's events in one transaction.
+
+    The outbox holds one pending Telegram notification per event, keyed by an idempotency
+    key; add_many() enqueues them in the same transaction as the events they announce.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.TCE_EVENTS_DB
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # SQLite's LIKE/lower() only fold ASCII; titles and halls are Cyrillic
+        self.conn.create_function('casefold', 1, lambda v: v.casefold() if isinstance(v, str) else v)
+        self.conn.executescript(_SCHEMA)
+        self._migrate_hall_key()
+        self._migrate_json()
+
+    def _migrate_hall_key(self) -> None:
+        """Add and backfill hall_key in stores created before it existed; index it."""
+        with self.conn:
+            columns = {row[1] for row in self.conn.execute('PRAGMA table_info(events)')}
+            if 'hall_key' not in columns:
+                self.conn.execute('ALTER TABLE events ADD COLUMN hall_key TEXT')
+                self.conn.create_function('hall_key', 1, _hall_key)
+                self.conn.execute('UPDATE events SET hall_key = hall_key(hall)')
+            self.conn.execute('DROP INDEX IF EXISTS idx_events_hall_starts_at')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_events_hall_key_starts_at ON events (hall_key, starts_at)')
+
+    def _migrate_json(self) -> None:
+        """One-time import of the legacy tce_events.json; the file is renamed to *.migrated."""
+        legacy = config.TCE_DATA_FILE
+        if not os.path.exists(legacy) or len(self):
+            return
+        try:
+            with open(legacy, 'r', encoding='utf-8') as f:
+                events = json.load(f)
+            inserted = self.add_many(events)
+            os.replace(legacy, legacy + '.migrated')
+            logging.info(f"Migrated {inserted} events from {legacy} to {self.path}")
+        except Exception as e:
+            logging.error(f"Error migrating {legacy}: {e}")
+
+    def __len__(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+
+    def __contains__(self, event_id) -> bool:
+        return self.conn.execute('SELECT 1 FROM events WHERE id = ?', (str(event_id),)).fetchone() is not None
+
+    def add_many(self, events, notifications=()) -> int:
+        """
+        Insert events not yet stored and enqueue `notifications` (outbox items, see enqueue())
+        in a single transaction. Returns how many events were new.
+        """
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO events (id, theatre, starts_at, hall, hall_key, title, found_at, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (_row(e) for e in events),
+            )
+            inserted = self.conn.total_changes - before
+            self._enqueue(notifications)
+            return inserted
+
+    def _enqueue(self, items) -> int:
+        before = self.conn.total_changes
+        now = time.time()
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO outbox (key, chat_id, kind, theatre, prefix, channel, event, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            ((i['key'], str(i['chat_id']), i['kind'], i.get('theatre'), i.get('prefix', ''), i.get('channel'),
+              json.dumps(i['event'], ensure_ascii=False), now) for i in items),
+        )
+        return self.conn.total_changes - before
+
+    def enqueue(self, items) -> int:
+        """
+        Add outbox items ({key, chat_id, kind, theatre, prefix, channel, event}). An item whose
+        key is already queued or delivered is ignored. Returns how many were added.
+        """
+        with self.conn:
+            return self._enqueue(items)
+
+    def outbox_due(self, now=None, limit=None) -> list:
+        """Pending outbox items whose next attempt is due, oldest first."""
+        sql = ('SELECT key, chat_id, kind, theatre, prefix, channel, event, attempts FROM outbox '
+               'WHERE status = ? AND next_attempt_at <= ? ORDER BY seq')
+        params = ['pending', time.time() if now is None else now]
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        columns = ('key', 'chat_id', 'kind', 'theatre', 'prefix', 'channel', 'event', 'attempts')
+        items = [dict(zip(columns, row)) for row in self.conn.execute(sql, params)]
+        for item in items:
+            item['event'] = json.loads(item['event'])
+        return items
+
+    def outbox_mark_sent(self, keys) -> None:
+        with self.conn:
+            now = time.time()
+            self.conn.executemany("UPDATE outbox SET status = 'sent', sent_at = ?, last_error = NULL WHERE key = ?",
+                                  ((now, k) for k in keys))
+
+    def outbox_mark_failed(self, keys, error: str, retry_at: float, max_attempts: int) -> int:
+        """Count a failed attempt; items reaching `max_attempts` become 'dead'. Returns how many died."""
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ?, next_attempt_at = ?, "
+                "status = CASE WHEN attempts + 1 >= ? THEN 'dead' ELSE status END WHERE key = ?",
+                ((error, retry_at, max_attempts, k) for k in keys),
+            )
+            marks = ','.join('?' * len(keys))
+            return self.conn.execute(f"SELECT COUNT(*) FROM outbox WHERE status = 'dead' AND key IN ({marks})",
+                                     list(keys)).fetchone()[0] if keys else 0
+
+    def outbox_counts(self) -> dict:
+        """{status: item count}"""
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status'))
+
+    def outbox_prune(self, older_than_days: float) -> int:
+        """
+        Forget delivered items older than the given age. Their keys only need to outlive the
+        state update that follows an enqueue, so a short retention is enough.
+        """
+        with self.conn:
+            cur = self.conn.execute("DELETE FROM outbox WHERE status = 'sent' AND sent_at < ?",
+                                    (time.time() - older_than_days * 86400,))
+            return cur.rowcount
+
+    def outbox_retry_dead(self) -> int:
+        """Give items that exhausted their attempts a fresh set of retries."""
+        with self.conn:
+            return self.conn.execute("UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = 0 "
+                                     "WHERE status = 'dead'").rowcount
+
+    def outbox_forget_delivered(self) -> int:
+        """Forget every delivered item, so cleared state re-announces its events."""
+        with self.conn:
+            return self.conn.execute("DELETE FROM outbox WHERE status = 'sent'").rowcount
+
+    def replace_all(self, events) -> None:
+        """Replace the stored events with `events` (legacy save_tce_data semantics)."""
+        with self.conn:
+            self.conn.execute('DELETE FROM events')
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO events (id, theatre, starts_at, hall, hall_key, title, found_at, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (_row(e) for e in events),
+            )
+
+    def ids_before(self, day: str) -> list:
+        """IDs of stored events whose show starts before `day` (YYYY-MM-DD)."""
+        return [row[0] for row in self.conn.execute('SELECT id FROM events WHERE starts_at < ?', (day,))]
+
+    _ORDER = {
+        'starts_at': 'starts_at, title',
+        'found_at': 'found_at, starts_at',
+        'title': 'casefold(title), starts_at',
+        'hall': 'hall, starts_at',
+    }
+
+    def query(self, date_from=None, date_to=None, hall=None, title=None, theatre=None,
+              found_from=None, found_to=None, order='starts_at', limit=None) -> list:
+        """
+        Events matching all given filters, as dicts. Dates are inclusive `date`s (show start /
+        found_at day). hall is a case-insensitive prefix of the hall name and title a
+        case-insensitive substring. The date range, found_at bounds and hall prefix are
+        answered from the starts_at, found_at and (hall_key, starts_at) indexes; the title
+        is checked on the rows those leave.
+        """
+        where, params = [], []
+        if date_from:
+            where.append('starts_at >= ?')
+            params.append(date_from.isoformat())
+        if date_to:
+            where.append('starts_at < ?')
+            params.append((date_to + timedelta(days=1)).isoformat())
+        if found_from:
+            where.append('found_at >= ?')
+            params.append(found_from.isoformat())
+        if found_to:
+            where.append('found_at < ?')
+            params.append((found_to + timedelta(days=1)).isoformat())
+        if theatre:
+            where.append('theatre = ?')
+            params.append(theatre)
+        if hall:
+            key = _hall_key(hall)
+            where.append('hall_key >= ? AND hall_key < ?')
+            params += [key, key + '\U0010ffff']
+        if title:
+            where.append('instr(casefold(title), ?) > 0')
+            params.append(title.casefold())
+        sql = 'SELECT data FROM events'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f" ORDER BY {self._ORDER[order]}"
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        return [json.loads(data) for (data,) in self.conn.execute(sql, params)]
+
+    def all(self) -> list:
+        """All events as dicts, in insertion order."""
+        return [json.loads(data) for (data,) in self.conn.execute('SELECT data FROM events ORDER BY rowid')]
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+_store = None
+
+
+def get_event_store() -> EventStore:
+    """Process-wide store, opened (and migrated) on first use."""
+    global _store
+    if _store is None or _store.path != config.TCE_EVENTS_DB:
+        _store = EventStore()
+    return _store
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""Local stand-in for tce.by and the Telegram Bot API, for offline end-to-end runs.
+
+Serves:
+  GET  /                                          homepage
+  GET  /search.html                               challenge page until the clearance cookie is set
+  POST /index.php?view=shows&action=find&kind=text  search API (needs the clearance cookie)
+  GET  /shows.html?base=<key>&data=<bk_id>        show page with an og:image poster (needs the cookie)
+  GET  /posters/<n>.jpg                           poster image, one per title
+  POST /bot<token>/<method>                       Telegram Bot API (sendMessage, sendPhoto, sendMediaGroup
+                                                  with multipart uploads answered with photo file_ids...)
+  GET  /_stats                                    request counters and recorded Telegram messages
+
+Usage:
+  python fake_tce_server.py --port 8765 --latency-ms 150 --tail-ms 2000 --tail-rate 0.05
+  TCE_ORIGIN=http://127.0.0.1:8765 TELEGRAM_API_URL=http://127.0.0.1:8765 python main.py
+
+Used programmatically by e2e_harness.py.
+"""
+import argparse
+import email.parser
+import email.policy
+import hashlib
+import json
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CLEARANCE_COOKIE = 'fake-anubis-auth'
+
+_HOMEPAGE = """<!doctype html><html><head><title>tce.by (fake)</title></head>
+<body><h1>Fake tce.by</h1><a href="/search.html">Поиск</a></body></html>"""
+
+_SEARCH_PAGE = """<!doctype html><html><head><title>Поиск (fake)</title></head>
+<body><h1>Search</h1><form id="search"></form></body></html>"""
+
+# Simulated Anubis step: "solve" for a while, set the cookie, reload
+_CHALLENGE_PAGE = """<!doctype html><html><head><title>Making sure you're not a bot!</title></head>
+<body><p>Checking your browser…</p>
+<script id="anubis_challenge" type="application/json">{"difficulty": 1}</script>
+<script>
+setTimeout(function () {
+    document.cookie = "%(cookie)s=ok; path=/; max-age=604800";
+    location.reload();
+}, %(delay)d);
+</script></body></html>"""
+
+_SHOW_PAGE = """<!doctype html><html><head><title>%(title)s (fake)</title>
+<meta property="og:image" content="/posters/%(poster)d.jpg"></head>
+<body><h1>%(title)s</h1></body></html>"""
+
+_TITLES = ["Золушка", "Буратино", "Снежная королева", "Кот в сапогах", "Теремок", "Колобок"]
+_HALLS = [("Большой зал", "ул. Энгельса, 20"), ("Малый зал", "ул. Энгельса, 20")]
+
+
+class FakeTceState:
+    """Schedule, fault-injection knobs and counters shared by all handler threads."""
+
+    def __init__(self, server_key, events=120, latency_ms=100, tail_ms=0, tail_rate=0.0,
+                 error_rate=0.0, cap=100, clearance_ms=1500, telegram_latency_ms=50,
+                 telegram_429_rate=0.0, seed=1):
+        self.server_key = server_key
+        self.latency_ms = latency_ms
+        self.tail_ms = tail_ms
+        self.tail_rate = tail_rate
+        self.error_rate = error_rate
+        self.cap = cap
+        self.clearance_ms = clearance_ms
+        self.telegram_latency_ms = telegram_latency_ms
+        self.telegram_429_rate = telegram_429_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.events = []
+        self.next_id = 4000
+        self.counters = {'homepage': 0, 'search_page': 0, 'challenge': 0, 'search_api': 0,
+                         'search_api_errors': 0, 'search_api_rejected': 0, 'show_page': 0, 'poster_image': 0,
+                         'telegram': 0, 'telegram_429': 0, 'telegram_uploads': 0}
+        self.messages = []
+        self.add_events(events)
+
+    def add_events(self, n, start=None):
+        """Append n shows spread over the coming months (about 1.5 per day)."""
+        start = start or date.today()
+        with self.lock:
+            for _ in range(n):
+                hall, address = self.rng.choice(_HALLS)
+                day = start + timedelta(days=self.rng.randrange(0, 120))
+                when = datetime(day.year, day.month, day.day, self.rng.choice([11, 13, 18]))
+                self.events.append({
+                    'bk_id': self.next_id,
+                    'server_key': self.server_key,
+                    'show_name': self.rng.choice(_TITLES),
+                    'bk_date': when.strftime('%Y-%m-%d %H:%M:%S'),
+                    'hall_name': hall,
+                    'hall_address': address,
+                    'owner_name': 'Fake theatre',
+                })
+                self.next_id += 1
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.counters[key] += n
+
+    def api_delay(self) -> float:
+        delay = self.latency_ms
+        if self.tail_rate and self.rng.random() < self.tail_rate:
+            delay += self.tail_ms
+        return delay / 1000.0
+
+    def search(self, form) -> list:
+        begin, end = form.get('date_begin', ''), form.get('date_end', '~')
+        with self.lock:
+            found = [e for e in self.events
+                     if e['server_key'] == form.get('server_key') and begin <= e['bk_date'][:10] <= end]
+        found.sort(key=lambda e: e['bk_date'])
+        return found[:self.cap]
+
+    def title_of(self, bk_id):
+        with self.lock:
+            return next((e['show_name'] for e in self.events if str(e['bk_id']) == str(bk_id)), None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'counters': dict(self.counters), 'events': len(self.events), 'messages': list(self.messages)}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'FakeTce/1.0'
+
+    @property
+    def state(self) -> FakeTceState:
+        return self.server.state
+
+    def log_message(self, fmt, *args):  # keep harness output readable
+        pass
+
+    def _send(self, status, body, content_type='text/html; charset=utf-8', headers=None):
+        data = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _json(self, status, payload):
+        self._send(status, json.dumps(payload, ensure_ascii=False), 'application/json; charset=utf-8')
+
+    def _cleared(self) -> bool:
+        return f"{CLEARANCE_COOKIE}=ok" in (self.headers.get('Cookie') or '')
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _telegram_request(self):
+        """(fields, uploaded files {field: bytes}) of a JSON or multipart/form-data Bot API call."""
+        body = self._body()
+        content_type = self.headers.get('Content-Type') or ''
+        if not content_type.startswith('multipart/form-data'):
+            return json.loads(body or b'{}'), {}
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+        fields, files = {}, {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            data = part.get_payload(decode=True) or b''
+            if part.get_filename():
+                files[name] = data
+            else:
+                value = data.decode('utf-8')
+                fields[name] = json.loads(value) if value[:1] in '[{' else value
+        return fields, files
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path
+        if path == '/':
+            self.state.count('homepage')
+            self._send(200, _HOMEPAGE)
+        elif path == '/search.html':
+            if self._cleared():
+                self.state.count('search_page')
+                self._send(200, _SEARCH_PAGE)
+            else:
+                self.state.count('challenge')
+                self._send(200, _CHALLENGE_PAGE % {'cookie': CLEARANCE_COOKIE, 'delay': self.state.clearance_ms})
+        elif path == '/shows.html':
+            title = self.state.title_of(parse_qs(url.query).get('data', [''])[0])
+            if not self._cleared():
+                self.state.count('challenge')
+                self._send(200, _CHALLENGE_PAGE % {'cookie': CLEARANCE_COOKIE, 'delay': self.state.clearance_ms})
+            elif title is None:
+                self._send(404, 'not found')
+            else:
+                self.state.count('show_page')
+                self._send(200, _SHOW_PAGE % {'title': title, 'poster': _TITLES.index(title)})
+        elif path.startswith('/posters/') and path.endswith('.jpg'):
+            self.state.count('poster_image')
+            # Not a real JPEG, but distinct per title and served as one
+            self._send(200, b'\xff\xd8\xff\xe0fake-poster-' + path.encode('utf-8'), 'image/jpeg')
+        elif path == '/_stats':
+            self._json(200, self.state.stats())
+        else:
+            self._send(404, 'not found')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == '/index.php':
+            self._search_api(url)
+        elif url.path.startswith('/bot'):
+            self._telegram(url.path.rsplit('/', 1)[-1])
+        else:
+            self._send(404, 'not found')
+
+    def _search_api(self, url):
+        form = {k: v[0] for k, v in parse_qs(self._body().decode('utf-8')).items()}
+        if not self._cleared():
+            # Like Anubis: an uncleared request gets the HTML challenge, not JSON
+            self.state.count('search_api_rejected')
+            self._send(200, _CHALLENGE_PAGE % {'cookie': CLEARANCE_COOKIE, 'delay': self.state.clearance_ms})
+            return
+        self.state.count('search_api')
+        time.sleep(self.state.api_delay())
+        if self.state.error_rate and self.state.rng.random() < self.state.error_rate:
+            self.state.count('search_api_errors')
+            self._send(500, 'Internal Server Error')
+            return
+        self._json(200, {'data': self.state.search(form), 'success': True})
+
+    def _telegram(self, method):
+        payload, files = self._telegram_request()
+        self.state.count('telegram')
+        time.sleep(self.state.telegram_latency_ms / 1000.0)
+        if self.state.telegram_429_rate and self.state.rng.random() < self.state.telegram_429_rate:
+            self.state.count('telegram_429')
+            self._json(429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                             'parameters': {'retry_after': 1}})
+            return
+        # Photos: an upload (attach://<field>, or the file itself under 'photo') gets a file_id
+        # derived from its bytes; a photo sent by file_id echoes it
+        if method == 'sendMediaGroup':
+            photos = [m.get('media') for m in payload.get('media') or []]
+        elif method == 'sendPhoto':
+            photos = [payload.get('photo') or 'attach://photo']
+        else:
+            photos = []
+        file_ids = []
+        for ref in photos:
+            data = files.get(ref[len('attach://'):]) if str(ref).startswith('attach://') else None
+            file_ids.append(f"fake-photo-{hashlib.sha1(data).hexdigest()[:16]}" if data is not None else ref)
+        if files:
+            self.state.count('telegram_uploads', len(files))
+        chat = {'id': payload.get('chat_id')}
+        with self.state.lock:
+            self.state.messages.append({'method': method, 'chat_id': payload.get('chat_id'),
+                                        'length': len(payload.get('text') or payload.get('caption') or ''),
+                                        'photos': len(photos), 'uploads': len(files)})
+            message_id = len(self.state.messages)
+        if method == 'sendMediaGroup':
+            result = [{'message_id': message_id + i, 'chat': chat,
+                       'photo': [{'file_id': f, 'file_unique_id': f, 'width': 320, 'height': 480}]}
+                      for i, f in enumerate(file_ids)]
+        else:
+            result = {'message_id': message_id, 'chat': chat}
+            if file_ids:
+                result['photo'] = [{'file_id': file_ids[0], 'file_unique_id': file_ids[0], 'width': 320, 'height': 480}]
+        self._json(200, {'ok': True, 'result': result})
+
+
+class FakeTceServer:
+    """Run the fake site in a background thread: `with FakeTceServer(state) as server: server.url`."""
+
+    def __init__(self, state: FakeTceState, host='127.0.0.1', port=0):
+        self.state = state
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = state
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_state_arguments(parser) -> None:
+    """CLI knobs shared with e2e_harness.py."""
+    parser.add_argument('--events', type=int, default=120, help='Shows in the initial schedule')
+    parser.add_argument('--latency-ms', type=int, default=100, help='Search API base latency')
+    parser.add_argument('--tail-ms', type=int, default=0, help='Extra latency for tail requests')
+    parser.add_argument('--tail-rate', type=float, default=0.0, help='Fraction of requests that get --tail-ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of search requests answered with 500')
+    parser.add_argument('--cap', type=int, default=100, help='Maximum results per search response')
+    parser.add_argument('--clearance-ms', type=int, default=1500, help='Simulated challenge solve time')
+    parser.add_argument('--telegram-latency-ms', type=int, default=50, help='Fake Bot API latency')
+    parser.add_argument('--telegram-429-rate', type=float, default=0.0, help='Fraction of sends answered with 429')
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def state_from_args(args, server_key) -> FakeTceState:
+    return FakeTceState(
+        server_key, events=args.events, latency_ms=args.latency_ms, tail_ms=args.tail_ms,
+        tail_rate=args.tail_rate, error_rate=args.error_rate, cap=args.cap, clearance_ms=args.clearance_ms,
+        telegram_latency_ms=args.telegram_latency_ms, telegram_429_rate=args.telegram_429_rate, seed=args.seed,
+    )
+
+
+if __name__ == '__main__':
+    import config
+    parser = argparse.ArgumentParser(description='Fake tce.by + Telegram server for offline runs')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_state_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeTceServer(state_from_args(args, config.TCE_BASE_PARAM), args.host, args.port)
+    print(f"Fake tce.by + Telegram listening on {server.url}")
+    print(f"  TCE_ORIGIN={server.url} TELEGRAM_API_URL={server.url} python main.py")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
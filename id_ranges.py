@@ -0,0 +1,136 @@
+"""Compact range-encoded set of processed bk_ids and its on-disk state format"""
+import json
+import logging
+import os
+from bisect import bisect_right
+
+STATE_VERSION = 2
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class IdRangeSet:
+    """
+    Set of integer IDs stored as sorted, disjoint, non-adjacent [start, end] runs.
+    Memory is O(ranges): bk_ids are mostly contiguous, so thousands of IDs fit in a few runs.
+    Non-integer IDs (should the API ever return them) are kept in a small side set.
+    """
+
+    def __init__(self, ids=()):
+        self._starts = []
+        self._ends = []
+        self._other = set()
+        self.update(ids)
+
+    @classmethod
+    def from_ranges(cls, ranges, other=()):
+        s = cls()
+        for start, end in sorted((int(a), int(b)) for a, b in ranges):
+            if s._ends and start <= s._ends[-1] + 1:
+                s._ends[-1] = max(s._ends[-1], end)
+            else:
+                s._starts.append(start)
+                s._ends.append(end)
+        s._other = set(other)
+        return s
+
+    def ranges(self) -> list:
+        return [[a, b] for a, b in zip(self._starts, self._ends)]
+
+    def __contains__(self, value) -> bool:
+        x = _as_int(value)
+        if x is None:
+            return value in self._other
+        i = bisect_right(self._starts, x) - 1
+        return i >= 0 and x <= self._ends[i]
+
+    def __len__(self) -> int:
+        return sum(b - a + 1 for a, b in zip(self._starts, self._ends)) + len(self._other)
+
+    def __iter__(self):
+        for a, b in zip(self._starts, self._ends):
+            yield from range(a, b + 1)
+        yield from self._other
+
+    def __or__(self, other):
+        result = IdRangeSet.from_ranges(self.ranges(), self._other)
+        result.update(other)
+        return result
+
+    def add(self, value) -> None:
+        x = _as_int(value)
+        if x is None:
+            self._other.add(value)
+            return
+        i = bisect_right(self._starts, x) - 1
+        if i >= 0 and x <= self._ends[i]:
+            return
+        joins_left = i >= 0 and self._ends[i] == x - 1
+        joins_right = i + 1 < len(self._starts) and self._starts[i + 1] == x + 1
+        if joins_left and joins_right:
+            self._ends[i] = self._ends[i + 1]
+            del self._starts[i + 1], self._ends[i + 1]
+        elif joins_left:
+            self._ends[i] = x
+        elif joins_right:
+            self._starts[i + 1] = x
+        else:
+            self._starts.insert(i + 1, x)
+            self._ends.insert(i + 1, x)
+
+    def update(self, values) -> None:
+        if isinstance(values, IdRangeSet):
+            merged = IdRangeSet.from_ranges(self.ranges() + values.ranges(), self._other | values._other)
+            self._starts, self._ends, self._other = merged._starts, merged._ends, merged._other
+            return
+        for value in values:
+            self.add(value)
+
+    def discard(self, value) -> None:
+        x = _as_int(value)
+        if x is None:
+            self._other.discard(value)
+            return
+        i = bisect_right(self._starts, x) - 1
+        if i < 0 or x > self._ends[i]:
+            return
+        start, end = self._starts[i], self._ends[i]
+        del self._starts[i], self._ends[i]
+        if x < end:
+            self._starts.insert(i, x + 1)
+            self._ends.insert(i, end)
+        if start < x:
+            self._starts.insert(i, start)
+            self._ends.insert(i, x - 1)
+
+
+def load_id_state(path: str) -> IdRangeSet:
+    """
+    Read a processed-IDs state file. Understands both the compact v2 format
+    ({"version": 2, "ranges": [[a, b], ...]}) and the legacy {"processed_ids": [...]} list.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if 'ranges' in data:
+        return IdRangeSet.from_ranges(data['ranges'], data.get('other', []))
+    return IdRangeSet(data.get('processed_ids', []))
+
+
+def save_id_state(ids, path: str) -> None:
+    """Atomically write `ids` in the compact v2 format."""
+    if not isinstance(ids, IdRangeSet):
+        ids = IdRangeSet(ids)
+    data = {'version': STATE_VERSION, 'ranges': ids.ranges()}
+    if ids._other:
+        data['other'] = sorted(ids._other, key=str)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp, path)
+    logging.debug(f"Wrote {len(ids.ranges())} ID ranges to {path}")
@@ -0,0 +1,87 @@
+"""Non-blocking logging: records are queued by the caller and written by a listener thread"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from datetime import datetime
+
+import config
+import metrics
+
+_TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+
+class RunContextFilter(logging.Filter):
+    """Stamp each record with the current run id and metrics phase (in the logging thread)."""
+
+    def filter(self, record) -> bool:
+        record.run_id = metrics.current().run_id
+        record.phase = metrics.current_phase()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, thread, run_id, phase, message."""
+
+    def format(self, record) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'run_id': getattr(record, 'run_id', None),
+            'phase': getattr(record, 'phase', None),
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def _file_handler() -> logging.Handler:
+    if config.LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(
+            config.LOG_FILE, when=config.LOG_ROTATE_WHEN, backupCount=config.LOG_BACKUP_COUNT, encoding='utf-8')
+    return logging.handlers.RotatingFileHandler(
+        config.LOG_FILE, maxBytes=config.LOG_MAX_BYTES, backupCount=config.LOG_BACKUP_COUNT, encoding='utf-8')
+
+
+def setup_logging(level=None) -> None:
+    """
+    Route the root logger through a QueueHandler; a QueueListener thread writes the rotating
+    log file (LOG_FORMAT text or json) and the console. Flushed at interpreter exit.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    os.makedirs(config.LOG_DIR, exist_ok=True)
+
+    file_handler = _file_handler()
+    file_handler.setFormatter(JsonFormatter() if config.LOG_FORMAT == 'json' else logging.Formatter(_TEXT_FORMAT))
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(_TEXT_FORMAT))
+
+    records = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(RunContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level or config.LOG_LEVEL)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(records, file_handler, console, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Write out every queued record and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,22 +1,111 @@
 """Main entry point for the theater monitoring script"""
 import logging
 import argparse
+import signal
 import sys
-from tce_monitor import check_for_new_tce_events
-
-
-def setup_logging():
-    import config
-    import os
-    os.makedirs(config.LOG_DIR, exist_ok=True)
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(config.LOG_FILE, encoding='utf-8'),
-            logging.StreamHandler(),
-        ]
+import threading
+import config
+import metrics
+
+
+def setup_logging(verbose=False):
+    import log_setup  # lazy: keeps --help fast
+    log_setup.setup_logging(logging.DEBUG if verbose else None)
+
+
+def run_once(args, session=None, deliver=True):
+    from tce_monitor import check_for_new_tce_events  # lazy: keeps --help fast
+    new_events = check_for_new_tce_events(
+        use_test_channel=args.test_channel,
+        notify=not args.no_notify,
+        session=session,
+        allow_partial=True if args.allow_partial else None,
+        deliver=deliver,
     )
+    if new_events:
+        suffix = " (notifications suppressed)" if args.no_notify else " and queued notifications"
+        logging.info(f"Completed: found {len(new_events)} new events{suffix}")
+    else:
+        logging.info("Completed: no new events")
+
+
+def drain_once(args):
+    """Deliver the queued notifications (no browser), optionally reviving given-up ones first."""
+    from event_store import get_event_store
+    from tce_monitor import drain_outbox
+    if args.retry_dead:
+        logging.info(f"Re-queued {get_event_store().outbox_retry_dead()} given-up notification(s)")
+    totals = drain_outbox()
+    logging.info(f"Completed: delivered {totals['sent']} queued notification(s), {totals['pending']} pending")
+
+
+def _outbox_worker(done, wake):
+    """Drain the outbox after every poll and retry due items in between, until the polling loop is `done`."""
+    from event_store import EventStore
+    from tce_monitor import drain_outbox
+    store = EventStore()  # SQLite connections are per thread
+    try:
+        while True:
+            wake.wait(config.TCE_OUTBOX_POLL_INTERVAL)
+            wake.clear()
+            # Each drain records into its own metrics, not into whichever poll is current
+            drain_metrics = metrics.RunMetrics()
+            metrics.bind(drain_metrics)
+            try:
+                drain_outbox(store=store)
+            except Exception as e:
+                logging.error(f"Outbox drain failed: {e}")
+            finally:
+                metrics.bind(None)
+            if drain_metrics.counters:
+                logging.info(f"Outbox worker drain: counters {drain_metrics.counters}")
+            if done.is_set():
+                break
+    finally:
+        store.close()
+
+
+def run_daemon(args):
+    """
+    Poll every `args.interval` seconds with one warm browser until SIGTERM/SIGINT.
+    Notifications are delivered by a background worker, so a slow Telegram never delays a poll.
+    """
+    from tce_fetch import TceBrowserSession
+    stop = threading.Event()
+    done = threading.Event()
+    wake = threading.Event()
+
+    def _request_stop(signum, _frame):
+        logging.info(f"Received signal {signum} — stopping after the current poll")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+    session = TceBrowserSession()
+    worker = threading.Thread(target=_outbox_worker, args=(done, wake), name='outbox', daemon=True)
+    worker.start()
+    logging.info(f"Daemon mode: polling every {args.interval}s, "
+                 f"browser rebuilt every {config.DAEMON_MAX_CYCLES} polls or after a failure")
+    try:
+        while not stop.is_set():
+            try:
+                run_once(args, session=session, deliver=False)
+                wake.set()
+            except Exception as e:
+                logging.error(f"Poll failed, rebuilding browser: {e}")
+                session.close()
+            else:
+                if session.cycles >= config.DAEMON_MAX_CYCLES:
+                    logging.info(f"Browser served {session.cycles} polls — rebuilding")
+                    session.close()
+            stop.wait(args.interval)
+    finally:
+        session.close()
+        done.set()
+        wake.set()
+        worker.join(timeout=60)  # one last drain for what the final poll queued
+        logging.info("Daemon stopped")
 
 
 def main():
@@ -25,21 +114,36 @@ def main():
                         help='Send notifications to test channel instead of production')
     parser.add_argument('--no-notify', action='store_true',
                         help='Collect and save events without sending Telegram notifications (use on first run to populate state)')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running and poll every --interval seconds, reusing one warm browser')
+    parser.add_argument('--interval', type=int, default=900,
+                        help='Seconds between polls in --daemon mode (default: 900)')
+    parser.add_argument('--allow-partial', action='store_true',
+                        help='Diff, notify and persist even when some windows failed (default: wait for a re-run)')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Log at DEBUG (every event and notified title)')
+    parser.add_argument('--drain-only', action='store_true',
+                        help='Only deliver queued notifications (no browser, no fetch)')
+    parser.add_argument('--retry-dead', action='store_true',
+                        help='With --drain-only: retry notifications that exhausted TCE_OUTBOX_MAX_ATTEMPTS')
     args = parser.parse_args()
+    if args.interval <= 0:
+        parser.error('--interval must be positive')
+    if args.retry_dead and not args.drain_only:
+        parser.error('--retry-dead requires --drain-only')
 
-    setup_logging()
+    setup_logging(args.verbose)
     logging.info("Starting theater performance monitor")
 
+    if args.daemon:
+        run_daemon(args)
+        return
+
     try:
-        new_events = check_for_new_tce_events(
-            use_test_channel=args.test_channel,
-            notify=not args.no_notify,
-        )
-        if new_events:
-            suffix = " (notifications suppressed)" if args.no_notify else " and notified"
-            logging.info(f"Completed: found {len(new_events)} new events{suffix}")
+        if args.drain_only:
+            drain_once(args)
         else:
-            logging.info("Completed: no new events")
+            run_once(args)
     except Exception as e:
         logging.error(f"Error in main process: {e}")
         sys.exit(1)
@@ -1,50 +1,135 @@
 #!/usr/bin/env python3
-"""Utility to view or clear the processed TCE event IDs state.
+"""Utility to view, compact, prune or clear the processed TCE event IDs state.
 
 Usage:
-  python manage_processed_ids.py --show     # print count and all IDs
-  python manage_processed_ids.py --clear    # delete state file (next run re-notifies all)
+  python manage_processed_ids.py --show                     # print count and ID ranges
+  python manage_processed_ids.py --stats                    # size/format statistics
+  python manage_processed_ids.py --compact                  # rewrite in the compact range format
+  python manage_processed_ids.py --prune-before 2026-03-01  # forget IDs of shows before DATE
+  python manage_processed_ids.py --clear                    # delete state file (next run re-notifies all)
+
+Add --state PATH to work on another theatre's state file.
 """
 import argparse
 import json
 import os
 import sys
+from datetime import date
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 import config
+from id_ranges import load_id_state, save_id_state
+
+
+def _format_ranges(ranges) -> str:
+    return ', '.join(str(a) if a == b else f"{a}–{b}" for a, b in ranges)
 
 
-def show():
-    if not os.path.exists(config.TCE_PROCESSED_IDS_FILE):
-        print(f"State file not found: {config.TCE_PROCESSED_IDS_FILE}")
+def show(path):
+    if not os.path.exists(path):
+        print(f"State file not found: {path}")
         return
-    with open(config.TCE_PROCESSED_IDS_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    ids = data.get('processed_ids', [])
+    ids = load_id_state(path)
     print(f"Processed event IDs: {len(ids)}")
-    print(f"File: {config.TCE_PROCESSED_IDS_FILE}")
-    if ids:
-        print(f"ID range: {min(ids)} – {max(ids)}")
-        print(f"IDs: {ids}")
+    print(f"File: {path}")
+    ranges = ids.ranges()
+    if ranges:
+        print(f"ID range: {ranges[0][0]} – {ranges[-1][1]}")
+        print(f"IDs: {_format_ranges(ranges)}")
 
 
-def clear():
-    if not os.path.exists(config.TCE_PROCESSED_IDS_FILE):
+def stats(path):
+    if not os.path.exists(path):
+        print(f"State file not found: {path}")
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    ids = load_id_state(path)
+    ranges = ids.ranges()
+    print(f"File: {path}")
+    print(f"Format: {'v' + str(data.get('version')) + ' (ranges)' if 'ranges' in data else 'legacy (ID list)'}")
+    print(f"Size on disk: {os.path.getsize(path)} bytes")
+    print(f"IDs: {len(ids)} in {len(ranges)} range(s)")
+    if ranges:
+        print(f"Span: {ranges[0][0]} – {ranges[-1][1]}")
+        print(f"Largest range: {max(b - a + 1 for a, b in ranges)} IDs")
+
+
+def compact(path):
+    if not os.path.exists(path):
+        print(f"State file not found: {path}")
+        return
+    before = os.path.getsize(path)
+    ids = load_id_state(path)
+    save_id_state(ids, path)
+    print(f"Compacted {len(ids)} IDs into {len(ids.ranges())} range(s): {before} → {os.path.getsize(path)} bytes")
+
+
+def prune_before(path, day):
+    if not os.path.exists(path):
+        print(f"State file not found: {path}")
+        return
+    from event_store import EventStore
+    if day >= date.today().isoformat():
+        print("Refusing to prune today or later: those shows are still returned by the search API "
+              "and would be re-notified.")
+        return
+    ids = load_id_state(path)
+    before = len(ids)
+    for event_id in EventStore().ids_before(day):
+        ids.discard(event_id)
+    save_id_state(ids, path)
+    print(f"Pruned {before - len(ids)} IDs of shows before {day}; {len(ids)} remain "
+          f"in {len(ids.ranges())} range(s)")
+
+
+def clear(path):
+    if not os.path.exists(path):
         print("State file does not exist, nothing to clear.")
         return
-    os.remove(config.TCE_PROCESSED_IDS_FILE)
-    print(f"Deleted {config.TCE_PROCESSED_IDS_FILE}")
+    os.remove(path)
+    print(f"Deleted {path}")
+    for kind in ('fingerprints', 'index', 'checkpoint'):
+        sidecar = f"{os.path.splitext(path)[0]}.{kind}.json"
+        if os.path.exists(sidecar):
+            os.remove(sidecar)
+            print(f"Deleted {sidecar}")
+    if os.path.exists(config.TCE_EVENTS_DB):
+        # Delivered outbox keys would otherwise suppress the re-announcements
+        from event_store import EventStore
+        store = EventStore()
+        print(f"Forgot {store.outbox_forget_delivered()} delivered notification key(s)")
+        store.close()
     print("Next run will re-notify all current events.")
 
 
+def _date_arg(value):
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD, got {value!r}")
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Manage TCE processed event IDs')
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument('--show', action='store_true', help='Show current state')
+    group.add_argument('--stats', action='store_true', help='Show state size and format statistics')
+    group.add_argument('--compact', action='store_true', help='Rewrite the state in the compact range format')
+    group.add_argument('--prune-before', metavar='DATE', type=_date_arg,
+                       help='Forget IDs of shows before DATE (YYYY-MM-DD), using the event store for show dates')
     group.add_argument('--clear', action='store_true', help='Delete state file')
+    parser.add_argument('--state', default=config.TCE_PROCESSED_IDS_FILE,
+                        help='State file to operate on (default: %(default)s)')
     args = parser.parse_args()
 
     if args.show:
-        show()
+        show(args.state)
+    elif args.stats:
+        stats(args.state)
+    elif args.compact:
+        compact(args.state)
+    elif args.prune_before:
+        prune_before(args.state, args.prune_before)
     elif args.clear:
-        clear()
+        clear(args.state)
@@ -0,0 +1,190 @@
+"""Per-run phase timings and counters, exported as a Prometheus textfile and a JSON run report"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+import config
+
+
+class RunMetrics:
+    """
+    Timings and counters for one monitoring run.
+
+    phase() times a block (browser launch, navigation, one window POST, a Telegram send...),
+    incr() bumps a counter. finish() writes both export formats. Recording is thread-safe
+    (delivery threads share the run); anything recorded after finish() is dropped.
+    """
+
+    def __init__(self):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.phases = []   # [{'phase', 'seconds', 'ok', **labels}] in completion order
+        self.counters = {}
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def _add_phase(self, record) -> None:
+        with self._lock:
+            if not self.finished:
+                self.phases.append(record)
+
+    @contextmanager
+    def phase(self, name: str, **labels):
+        """Time the enclosed block. Labels (theatre, window, counts...) go into the JSON report only."""
+        record = {'phase': name, **labels}
+        stack = _active_phases()
+        stack.append(name)
+        t0 = time.perf_counter()
+        try:
+            yield record  # callers may add fields (event count, payload size) inside the block
+            record.setdefault('ok', True)
+        except BaseException:
+            record['ok'] = False
+            raise
+        finally:
+            record['seconds'] = time.perf_counter() - t0
+            self._add_phase(record)
+            stack.pop()
+
+    def observe(self, name: str, seconds: float, ok=True, **labels) -> None:
+        """Record a phase measured elsewhere (e.g. a Telegram call timed by the client)."""
+        self._add_phase({'phase': name, 'seconds': seconds, 'ok': ok, **labels})
+
+    def incr(self, name: str, n=1) -> None:
+        with self._lock:
+            if not self.finished:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self) -> dict:
+        """Per-phase count, total, max and failures."""
+        out = {}
+        with self._lock:
+            phases = list(self.phases)
+        for p in phases:
+            s = out.setdefault(p['phase'], {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'failed': 0})
+            s['count'] += 1
+            s['seconds'] += p['seconds']
+            s['max_seconds'] = max(s['max_seconds'], p['seconds'])
+            s['failed'] += 0 if p['ok'] else 1
+        return out
+
+    def report(self, success: bool) -> dict:
+        with self._lock:
+            counters, phases = dict(self.counters), list(self.phases)
+        return {
+            'run_id': self.run_id,
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(),
+            'duration_seconds': time.perf_counter() - self._t0,
+            'success': success,
+            'counters': counters,
+            'phase_summary': self.summary(),
+            'phases': phases,
+        }
+
+    def prometheus(self, report: dict) -> str:
+        """Prometheus text exposition of one run (for node_exporter's textfile collector)."""
+        lines = [
+            '# HELP tce_run_success 1 if the last run completed without an exception.',
+            '# TYPE tce_run_success gauge',
+            f"tce_run_success {1 if report['success'] else 0}",
+            '# HELP tce_run_timestamp_seconds Start time of the last run.',
+            '# TYPE tce_run_timestamp_seconds gauge',
+            f"tce_run_timestamp_seconds {self.started_at:.0f}",
+            '# HELP tce_run_duration_seconds Wall time of the last run.',
+            '# TYPE tce_run_duration_seconds gauge',
+            f"tce_run_duration_seconds {report['duration_seconds']:.3f}",
+        ]
+        summary = report['phase_summary']
+        for metric, key, help_text in (
+            ('tce_phase_seconds_total', 'seconds', 'Time spent in each phase during the last run.'),
+            ('tce_phase_seconds_max', 'max_seconds', 'Slowest single occurrence of each phase in the last run.'),
+            ('tce_phase_count', 'count', 'Occurrences of each phase in the last run.'),
+            ('tce_phase_failed', 'failed', 'Failed occurrences of each phase in the last run.'),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+            for phase, s in sorted(summary.items()):
+                value = s[key]
+                lines.append(f'{metric}{{phase="{phase}"}} {value:.3f}' if isinstance(value, float)
+                             else f'{metric}{{phase="{phase}"}} {value}')
+        lines += ['# HELP tce_run_counter Counters of the last run (new events, retries, failures...).',
+                  '# TYPE tce_run_counter gauge']
+        for name, value in sorted(report['counters'].items()):
+            lines.append(f'tce_run_counter{{name="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def finish(self, success: bool) -> dict:
+        """
+        Close the run to further recording, then write the JSON report and the Prometheus
+        textfile (each atomically). Returns the report.
+        """
+        with self._lock:
+            self.finished = True
+        report = self.report(success)
+        for path, content in ((config.METRICS_REPORT_FILE, lambda: json.dumps(report, indent=2, ensure_ascii=False)),
+                              (config.METRICS_PROM_FILE, lambda: self.prometheus(report))):
+            if not path:
+                continue
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = path + '.tmp'
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    f.write(content())
+                os.replace(tmp, path)
+            except Exception as e:
+                logging.error(f"Error writing metrics to {path}: {e}")
+        logging.info(f"Run {self.run_id}: {report['duration_seconds']:.1f}s, counters {report['counters']}")
+        return report
+
+
+_current = RunMetrics()
+_local = threading.local()
+
+
+def _active_phases() -> list:
+    if not hasattr(_local, 'phases'):
+        _local.phases = []
+    return _local.phases
+
+
+def current_phase():
+    """Innermost phase() block open in the calling thread (for log records), or None."""
+    stack = _active_phases()
+    return stack[-1] if stack else None
+
+
+def start_run() -> RunMetrics:
+    """Begin a new run; module-level phase()/observe()/incr() record into it."""
+    global _current
+    _current = RunMetrics()
+    return _current
+
+
+def bind(run) -> None:
+    """
+    Make the calling thread record into `run` instead of the current run (None: undo).
+    For background threads that outlive a run, such as the daemon's outbox worker.
+    """
+    _local.run = run
+
+
+def current() -> RunMetrics:
+    """The run the calling thread records into: its bound run, else the current one."""
+    return getattr(_local, 'run', None) or _current
+
+
+def phase(name: str, **labels):
+    return current().phase(name, **labels)
+
+
+def observe(name: str, seconds: float, ok=True, **labels) -> None:
+    current().observe(name, seconds, ok, **labels)
+
+
+def incr(name: str, n=1) -> None:
+    current().incr(name, n)
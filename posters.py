@@ -0,0 +1,200 @@
+"""Show posters: a content-addressed LRU disk cache with bounded concurrent downloads"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import config
+
+_EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/webp': '.webp', 'image/gif': '.gif'}
+
+
+def title_key(title) -> str:
+    """Posters are per show, not per date: key by the normalised title."""
+    return ' '.join(str(title or '').casefold().split())
+
+
+class PosterCache:
+    """
+    Poster files under `root`, named by the SHA-256 of their bytes, so a poster shared by
+    many dates (or URLs) is stored and uploaded once. index.json keeps:
+
+      titles  {title key: poster URL}           (resolved from the API or show pages)
+      urls    {poster URL: sha256}
+      blobs   {sha256: {path, size, used_at, file_id}}
+
+    The cache is trimmed to TCE_POSTER_CACHE_MB by evicting the least recently used blobs.
+    The Telegram file_id of an uploaded poster is kept with its blob and reused for every
+    later send.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or config.TCE_POSTER_CACHE_DIR
+        self.index_path = os.path.join(self.root, 'index.json')
+        self._lock = threading.Lock()
+        self._index = self._load()
+
+    def _load(self) -> dict:
+        index = {'titles': {}, 'urls': {}, 'blobs': {}}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    index.update(json.load(f))
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable poster index: {e}")
+        return index
+
+    def save(self) -> None:
+        with self._lock:
+            try:
+                os.makedirs(self.root, exist_ok=True)
+                tmp = self.index_path + '.tmp'
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(self._index, f, ensure_ascii=False, separators=(',', ':'))
+                os.replace(tmp, self.index_path)
+            except Exception as e:
+                logging.error(f"Error saving poster index: {e}")
+
+    def poster_url(self, title):
+        return self._index['titles'].get(title_key(title))
+
+    def missing_titles(self, titles) -> list:
+        """Distinct titles with no poster lookup recorded yet (a failed lookup is recorded as '')."""
+        seen, missing = set(), []
+        for title in titles:
+            key = title_key(title)
+            if key and key not in seen and key not in self._index['titles']:
+                seen.add(key)
+                missing.append(title)
+        return missing
+
+    def remember_titles(self, urls_by_title: dict) -> None:
+        with self._lock:
+            for title, url in urls_by_title.items():
+                self._index['titles'][title_key(title)] = url or ''
+
+    def file_id(self, sha):
+        blob = self._index['blobs'].get(sha)
+        return blob.get('file_id') if blob else None
+
+    def set_file_id(self, sha, file_id) -> None:
+        with self._lock:
+            if sha in self._index['blobs']:
+                self._index['blobs'][sha]['file_id'] = file_id
+
+    def get(self, urls) -> dict:
+        """
+        {url: (sha256, path)} for the given poster URLs, downloading the uncached ones
+        concurrently (at most TCE_POSTER_WORKERS at a time). URLs that fail are left out.
+        """
+        found, missing = {}, []
+        for url in dict.fromkeys(u for u in urls if u):
+            cached = self._cached(url)
+            if cached:
+                found[url] = cached
+            else:
+                missing.append(url)
+        if missing:
+            import requests  # lazy: only poster delivery needs it here
+            session = requests.Session()
+            session.headers.update({'User-Agent': config.USER_AGENT, 'Accept-Language': config.ACCEPT_LANGUAGE})
+            for cookie in _session_cookies():
+                if isinstance(cookie, dict) and 'name' in cookie:
+                    session.cookies.set(cookie['name'], cookie.get('value', ''), domain=cookie.get('domain'))
+            with ThreadPoolExecutor(max_workers=max(1, config.TCE_POSTER_WORKERS)) as pool:
+                for url, result in zip(missing, pool.map(lambda u: self._download(session, u), missing)):
+                    if result:
+                        found[url] = result
+        now = time.time()
+        with self._lock:
+            for sha, _ in found.values():
+                self._index['blobs'][sha]['used_at'] = now
+        if missing:
+            self._evict(keep={sha for sha, _ in found.values()})
+        return found
+
+    def _cached(self, url):
+        sha = self._index['urls'].get(url)
+        blob = self._index['blobs'].get(sha) if sha else None
+        if blob and os.path.exists(blob['path']):
+            return sha, blob['path']
+        return None
+
+    def _download(self, session, url):
+        try:
+            response = session.get(url, timeout=20)
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+            if not content_type.startswith('image/'):
+                raise ValueError(f"not an image ({content_type or 'no content type'})")
+            data = response.content
+        except Exception as e:
+            logging.warning(f"Poster download failed for {url}: {e}")
+            return None
+        sha = hashlib.sha256(data).hexdigest()
+        ext = _EXTENSIONS.get(content_type) or os.path.splitext(urlsplit(url).path)[1] or '.img'
+        path = os.path.join(self.root, sha[:2], sha + ext)
+        with self._lock:
+            blob = self._index['blobs'].get(sha)
+            if not blob or not os.path.exists(blob['path']):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = path + '.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, path)
+                blob = self._index['blobs'][sha] = {'path': path, 'size': len(data), 'used_at': time.time(),
+                                                    'file_id': (blob or {}).get('file_id')}
+            self._index['urls'][url] = sha
+        return sha, blob['path']
+
+    def _evict(self, keep=()) -> None:
+        """Delete least recently used blobs (never those in `keep`) until the cache fits TCE_POSTER_CACHE_MB."""
+        limit = config.TCE_POSTER_CACHE_MB * 1024 * 1024
+        with self._lock:
+            blobs = self._index['blobs']
+            total = sum(b['size'] for b in blobs.values())
+            for sha, blob in sorted(blobs.items(), key=lambda item: item[1]['used_at']):
+                if total <= limit:
+                    break
+                if sha in keep:
+                    continue
+                try:
+                    os.remove(blob['path'])
+                except OSError:
+                    pass
+                total -= blob['size']
+                del blobs[sha]
+                logging.info(f"Evicted poster {sha[:12]} ({blob['size']} bytes) from the cache")
+            live = set(blobs)
+            self._index['urls'] = {u: s for u, s in self._index['urls'].items() if s in live}
+
+    def stats(self) -> dict:
+        blobs = self._index['blobs'].values()
+        return {'titles': len(self._index['titles']), 'blobs': len(blobs),
+                'bytes': sum(b['size'] for b in blobs), 'uploaded': sum(1 for b in blobs if b.get('file_id'))}
+
+
+def _session_cookies() -> list:
+    """Cookies of the stored tce.by clearance, so poster requests pass Anubis too."""
+    try:
+        with open(config.TCE_SESSION_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)['storage_state'].get('cookies', [])
+    except Exception:
+        return []
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_poster_cache() -> PosterCache:
+    """Process-wide cache (the fetch records title URLs; delivery downloads and uploads)."""
+    global _cache
+    with _cache_lock:
+        if _cache is None or _cache.root != config.TCE_POSTER_CACHE_DIR:
+            _cache = PosterCache()
+        return _cache
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Query stored TCE events (data/tce_events.sqlite3) by show date, hall, title and found-at.
+
+Usage:
+  python query_events.py --from today --days 7 --hall "Малый"        # what's on at a hall next week
+  python query_events.py --title золушка                             # every stored date of a show
+  python query_events.py --found-since 2026-10-01 --sort found_at    # recently announced shows
+  python query_events.py --from 2026-11-01 --to 2026-11-30 --format csv > november.csv
+
+Filters combine with AND. --hall is a case-insensitive prefix of the hall name (indexed);
+--title is a case-insensitive substring.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import config
+
+COLUMNS = ['date', 'time', 'title', 'venue', 'theatre', 'id', 'found_at', 'url']
+TABLE_COLUMNS = ['date', 'time', 'title', 'venue', 'theatre', 'id']
+
+
+def _date_arg(value):
+    if value == 'today':
+        return date.today()
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD or 'today', got {value!r}")
+
+
+def print_table(events, out=sys.stdout) -> None:
+    if not events:
+        print("No matching events.", file=out)
+        return
+    rows = [[str(e.get(c, '')) for c in TABLE_COLUMNS] for e in events]
+    widths = [min(max(len(c), *(len(r[i]) for r in rows)), 48) for i, c in enumerate(TABLE_COLUMNS)]
+    line = '  '.join(c.ljust(w) for c, w in zip(TABLE_COLUMNS, widths))
+    print(line, file=out)
+    print('  '.join('-' * w for w in widths), file=out)
+    for r in rows:
+        print('  '.join((v if len(v) <= w else v[:w - 1] + '…').ljust(w) for v, w in zip(r, widths)), file=out)
+    print(f"\n{len(events)} event(s)", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query stored TCE events')
+    parser.add_argument('--from', dest='date_from', type=_date_arg, help="First show date (YYYY-MM-DD or 'today')")
+    parser.add_argument('--to', dest='date_to', type=_date_arg, help='Last show date, inclusive')
+    parser.add_argument('--days', type=int, help='Show dates in the N days starting at --from (default: today)')
+    parser.add_argument('--hall', help='Start of the hall/venue name, case-insensitive')
+    parser.add_argument('--title', help='Title substring')
+    parser.add_argument('--theatre', help='Theatre name (see theatres.json)')
+    parser.add_argument('--found-since', type=_date_arg, help='Found by the monitor on or after this date')
+    parser.add_argument('--found-before', type=_date_arg, help='Found by the monitor on or before this date')
+    parser.add_argument('--sort', choices=['starts_at', 'found_at', 'title', 'hall'], default='starts_at')
+    parser.add_argument('--limit', type=int, help='At most N events')
+    parser.add_argument('--format', choices=['table', 'json', 'csv'], default='table')
+    parser.add_argument('--db', default=config.TCE_EVENTS_DB, help='Event store (default: %(default)s)')
+    args = parser.parse_args()
+
+    if args.days is not None:
+        if args.days <= 0:
+            parser.error('--days must be positive')
+        if args.date_to:
+            parser.error('use either --days or --to')
+        args.date_from = args.date_from or date.today()
+        args.date_to = args.date_from + timedelta(days=args.days - 1)
+    if not os.path.exists(args.db):
+        parser.error(f"event store not found: {args.db}")
+
+    from event_store import EventStore
+    store = EventStore(args.db)
+    try:
+        events = store.query(
+            date_from=args.date_from, date_to=args.date_to, hall=args.hall, title=args.title,
+            theatre=args.theatre, found_from=args.found_since, found_to=args.found_before,
+            order=args.sort, limit=args.limit,
+        )
+    finally:
+        store.close()
+
+    if args.format == 'json':
+        json.dump(events, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    elif args.format == 'csv':
+        writer = csv.DictWriter(sys.stdout, fieldnames=COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(events)
+    else:
+        print_table(events)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Query the snapshot history (data/tce_snapshots.sqlite3): what was listed when, and what changed.
+
+Usage:
+  python query_history.py --runs --limit 20                        # recent runs with +added -removed ~changed
+  python query_history.py --at 2026-10-01                          # what was listed at the end of that day
+  python query_history.py --at 2026-10-01T09:00 --format csv       # ... at a given time
+  python query_history.py --diff 2026-10-01 2026-10-08             # listed / delisted / changed in between
+  python query_history.py --event 123456                           # when one event appeared, changed, vanished
+  python query_history.py --stats                                  # history size
+
+Add --theatre NAME to restrict to one theatre (see theatres.json).
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import config
+
+EVENT_COLUMNS = ['bk_id', 'bk_date', 'show_name', 'hall_name']
+RUN_COLUMNS = ['taken_at', 'theatre', 'total', 'added', 'removed', 'changed', 'checkpoint']
+TIMELINE_COLUMNS = ['taken_at', 'change', 'theatre', 'bk_date', 'show_name', 'hall_name']
+
+
+def _time_arg(value, day_time='T23:59:59'):
+    """ISO timestamp; a bare date means the end of that day."""
+    if value in ('now', 'today'):
+        return datetime.now().isoformat(timespec='seconds')
+    try:
+        return date.fromisoformat(value).isoformat() + day_time
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).isoformat(timespec='seconds')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD[THH:MM[:SS]] or 'now', got {value!r}")
+
+
+def _since_arg(value):
+    """Like _time_arg, but a bare date means the start of that day."""
+    return _time_arg(value, day_time='')
+
+
+def print_rows(rows, columns, out=sys.stdout) -> None:
+    if not rows:
+        print("Nothing recorded.", file=out)
+        return
+    cells = [[str(r.get(c, '')) for c in columns] for r in rows]
+    widths = [min(max(len(c), *(len(r[i]) for r in cells)), 48) for i, c in enumerate(columns)]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)), file=out)
+    print('  '.join('-' * w for w in widths), file=out)
+    for r in cells:
+        print('  '.join((v if len(v) <= w else v[:w - 1] + '…').ljust(w) for v, w in zip(r, widths)), file=out)
+
+
+def output(rows, columns, fmt) -> None:
+    if fmt == 'json':
+        json.dump(rows, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    elif fmt == 'csv':
+        writer = csv.DictWriter(sys.stdout, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        print_rows(rows, columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the TCE snapshot history')
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument('--runs', action='store_true', help='List recorded runs, newest first')
+    action.add_argument('--at', type=_time_arg, metavar='WHEN', help='Events listed at WHEN')
+    action.add_argument('--diff', nargs=2, type=_time_arg, metavar=('FROM', 'TO'),
+                        help='Events added, removed and changed between two times')
+    action.add_argument('--event', metavar='BK_ID', help='History of one event')
+    action.add_argument('--stats', action='store_true', help='Runs, checkpoints and stored rows')
+    parser.add_argument('--theatre', help='Theatre name (default: all recorded theatres)')
+    parser.add_argument('--since', type=_since_arg, help='With --runs: only runs taken after this date')
+    parser.add_argument('--limit', type=int, help='With --runs: at most N runs')
+    parser.add_argument('--format', choices=['table', 'json', 'csv'], default='table')
+    parser.add_argument('--db', default=config.TCE_SNAPSHOTS_DB, help='Snapshot history (default: %(default)s)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"snapshot history not found: {args.db}")
+
+    from snapshots import SnapshotStore
+    store = SnapshotStore(args.db)
+    try:
+        theatres = [args.theatre] if args.theatre else store.theatres()
+        if args.stats:
+            for key, value in store.stats().items():
+                print(f"{key}: {value}")
+        elif args.runs:
+            output(store.runs(theatre=args.theatre, since=args.since, limit=args.limit), RUN_COLUMNS, args.format)
+        elif args.event:
+            output(store.timeline(args.event), TIMELINE_COLUMNS, args.format)
+        elif args.at:
+            rows = []
+            for theatre in theatres:
+                run, events = store.state_at(theatre, args.at)
+                if run and args.format == 'table':
+                    print(f"[{theatre}] {len(events)} event(s) as of the run at {run['taken_at']}")
+                rows += [{**e, 'theatre': theatre} for e in sorted(events, key=lambda e: e.get('bk_date', ''))]
+            output(rows, EVENT_COLUMNS + ['theatre'], args.format)
+        else:
+            rows = []
+            for theatre in theatres:
+                for change, events in store.diff(theatre, *args.diff).items():
+                    rows += [{'change': change, **e, 'theatre': theatre} for e in events]
+            output(rows, ['change'] + EVENT_COLUMNS + ['theatre'], args.format)
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""Delta-encoded history of every run's fetched event set, with periodic full checkpoints"""
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+    theatre    TEXT NOT NULL,
+    taken_at   TEXT NOT NULL,
+    checkpoint INTEGER NOT NULL DEFAULT 0,
+    total      INTEGER NOT NULL,
+    added      INTEGER NOT NULL,
+    removed    INTEGER NOT NULL,
+    changed    INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_theatre_taken_at ON runs (theatre, taken_at);
+
+CREATE TABLE IF NOT EXISTS items (
+    seq   INTEGER NOT NULL,
+    bk_id TEXT NOT NULL,
+    op    TEXT NOT NULL,
+    hash  TEXT,
+    PRIMARY KEY (seq, bk_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_items_bk_id ON items (bk_id, seq);
+
+CREATE TABLE IF NOT EXISTS contents (
+    hash TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# items.op: '+' added, '-' removed, '~' content changed since the previous run; a checkpoint
+# also lists every unchanged event as '=', so its rows other than '-' are the full set
+_DELTA_OPS = {'+': 'added', '-': 'removed', '~': 'changed'}
+
+_RUN_COLUMNS = ('seq', 'theatre', 'taken_at', 'checkpoint', 'total', 'added', 'removed', 'changed')
+
+
+class SnapshotStore:
+    """
+    One row per run and theatre in `runs`; `items` holds only what changed since the
+    previous run (bk_id added, removed or with a new content hash). A run is written as a
+    full checkpoint as well once the deltas since the last checkpoint add up to
+    TCE_SNAPSHOT_CHECKPOINT_RATIO × the set size, so replaying any state reads at most
+    about (1 + ratio) × its size rows and the file grows with churn, not runs × events.
+    Event contents are stored once per content hash in `contents`.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.TCE_SNAPSHOTS_DB
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+        self._heads = {}  # theatre -> (seq, {bk_id: hash}) of its latest run, for record()
+
+    def record(self, theatre: str, events: dict, taken_at=None) -> dict:
+        """
+        Store one run's fetched set for `theatre`, given as {bk_id: (hash, content dict)}.
+        Returns the run row (see runs()).
+        """
+        taken_at = taken_at or datetime.now().isoformat(timespec='seconds')
+        current = {str(k): h for k, (h, _) in events.items()}
+        last = self._latest_run(theatre)
+        head = self._heads.get(theatre)
+        if last is None:
+            previous = {}
+        elif head and head[0] == last['seq']:
+            previous = head[1]
+        else:
+            previous = self._replay(theatre, last['seq'])
+
+        added = [k for k in current if k not in previous]
+        removed = [k for k in previous if k not in current]
+        changed = [k for k in current if k in previous and previous[k] != current[k]]
+        churn = len(added) + len(removed) + len(changed)
+        checkpoint = last is None or (
+            self._churn_since_checkpoint(theatre) + churn >= max(1, len(current)) * config.TCE_SNAPSHOT_CHECKPOINT_RATIO)
+
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO contents (hash, data) VALUES (?, ?)',
+                                  ((h, json.dumps(c, ensure_ascii=False, sort_keys=True))
+                                   for h, c in events.values()))
+            seq = self.conn.execute(
+                'INSERT INTO runs (theatre, taken_at, checkpoint, total, added, removed, changed) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (theatre, taken_at, int(checkpoint), len(current), len(added), len(removed), len(changed)),
+            ).lastrowid
+            rows = [(seq, k, '+', current[k]) for k in added] + [(seq, k, '-', None) for k in removed] \
+                + [(seq, k, '~', current[k]) for k in changed]
+            if checkpoint:
+                delta = set(added) | set(changed)
+                rows += [(seq, k, '=', h) for k, h in current.items() if k not in delta]
+            self.conn.executemany('INSERT INTO items (seq, bk_id, op, hash) VALUES (?, ?, ?, ?)', rows)
+        self._heads[theatre] = (seq, current)
+        return dict(zip(_RUN_COLUMNS, (seq, theatre, taken_at, int(checkpoint), len(current),
+                                       len(added), len(removed), len(changed))))
+
+    def _latest_run(self, theatre, at=None):
+        sql = f"SELECT {', '.join(_RUN_COLUMNS)} FROM runs WHERE theatre = ?"
+        params = [theatre]
+        if at:
+            sql += ' AND taken_at <= ?'
+            params.append(at)
+        row = self.conn.execute(sql + ' ORDER BY seq DESC LIMIT 1', params).fetchone()
+        return dict(zip(_RUN_COLUMNS, row)) if row else None
+
+    def _churn_since_checkpoint(self, theatre) -> int:
+        return self.conn.execute(
+            'SELECT COALESCE(SUM(added + removed + changed), 0) FROM runs WHERE theatre = ? AND seq > '
+            '(SELECT COALESCE(MAX(seq), 0) FROM runs WHERE theatre = ? AND checkpoint = 1)',
+            (theatre, theatre)).fetchone()[0]
+
+    def _replay(self, theatre, seq) -> dict:
+        """{bk_id: hash} after run `seq`: its latest checkpoint plus the deltas up to it."""
+        base = self.conn.execute('SELECT MAX(seq) FROM runs WHERE theatre = ? AND checkpoint = 1 AND seq <= ?',
+                                 (theatre, seq)).fetchone()[0]
+        if base is None:
+            return {}
+        state = dict(self.conn.execute("SELECT bk_id, hash FROM items WHERE seq = ? AND op != '-'", (base,)))
+        deltas = self.conn.execute(
+            'SELECT bk_id, op, hash FROM items WHERE seq IN '
+            '(SELECT seq FROM runs WHERE theatre = ? AND seq > ? AND seq <= ?) ORDER BY seq',
+            (theatre, base, seq))
+        for bk_id, op, h in deltas:
+            if op == '-':
+                state.pop(bk_id, None)
+            else:
+                state[bk_id] = h
+        return state
+
+    def _contents(self, hashes) -> dict:
+        hashes, found = list(set(hashes)), {}
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            found.update((h, json.loads(d)) for h, d in self.conn.execute(
+                f"SELECT hash, data FROM contents WHERE hash IN ({','.join('?' * len(chunk))})", chunk))
+        return found
+
+    def theatres(self) -> list:
+        return [t for (t,) in self.conn.execute('SELECT DISTINCT theatre FROM runs ORDER BY theatre')]
+
+    def state_at(self, theatre: str, at=None):
+        """
+        (run, events) for the latest run of `theatre` taken at or before `at` (ISO timestamp,
+        default: now). events are {bk_id, **content} dicts; (None, []) before the first run.
+        """
+        run = self._latest_run(theatre, at)
+        if run is None:
+            return None, []
+        state = self._replay(theatre, run['seq'])
+        contents = self._contents(state.values())
+        return run, [{'bk_id': k, **contents.get(h, {})} for k, h in state.items()]
+
+    def diff(self, theatre: str, since: str, until=None) -> dict:
+        """{'added': [...], 'removed': [...], 'changed': [...]} event dicts between two run states."""
+        _, before = self.state_at(theatre, since)
+        _, after = self.state_at(theatre, until)
+        old = {e['bk_id']: e for e in before}
+        new = {e['bk_id']: e for e in after}
+        return {
+            'added': [e for k, e in new.items() if k not in old],
+            'removed': [e for k, e in old.items() if k not in new],
+            'changed': [e for k, e in new.items() if k in old and old[k] != e],
+        }
+
+    def timeline(self, bk_id) -> list:
+        """
+        When an event was listed, changed and removed: [{taken_at, theatre, change, **content}].
+        Its first appearance is reported as 'added' even when it was written in a checkpoint.
+        """
+        rows = self.conn.execute(
+            'SELECT r.taken_at, r.theatre, i.op, i.hash FROM items i JOIN runs r ON r.seq = i.seq '
+            'WHERE i.bk_id = ? ORDER BY i.seq', (str(bk_id),)).fetchall()
+        contents = self._contents(h for *_, h in rows if h)
+        history, present = [], False
+        for taken_at, theatre, op, h in rows:
+            if op == '=' and present:
+                continue  # a checkpoint repeating a state already reported
+            change = 'added' if op == '=' else _DELTA_OPS[op]
+            present = op != '-'
+            history.append({'taken_at': taken_at, 'theatre': theatre, 'change': change, **contents.get(h, {})})
+        return history
+
+    def runs(self, theatre=None, since=None, limit=None) -> list:
+        """Run rows (seq, theatre, taken_at, checkpoint, total, added, removed, changed), newest first."""
+        where, params = [], []
+        if theatre:
+            where.append('theatre = ?')
+            params.append(theatre)
+        if since:
+            where.append('taken_at >= ?')
+            params.append(since)
+        sql = f"SELECT {', '.join(_RUN_COLUMNS)} FROM runs"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY seq DESC'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        return [dict(zip(_RUN_COLUMNS, row)) for row in self.conn.execute(sql, params)]
+
+    def stats(self) -> dict:
+        count = lambda sql: self.conn.execute(sql).fetchone()[0]
+        return {
+            'runs': count('SELECT COUNT(*) FROM runs'),
+            'checkpoints': count('SELECT COUNT(*) FROM runs WHERE checkpoint = 1'),
+            'rows': count('SELECT COUNT(*) FROM items'),
+            'contents': count('SELECT COUNT(*) FROM contents'),
+            'bytes': os.path.getsize(self.path),
+        }
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+_store = None
+
+
+def get_snapshot_store() -> SnapshotStore:
+    """Process-wide store, opened on first use."""
+    global _store
+    if _store is None or _store.path != config.TCE_SNAPSHOTS_DB:
+        _store = SnapshotStore()
+    return _store
@@ -0,0 +1,812 @@
+"""Playwright fetch backend: Anubis clearance, session reuse and search-API window POSTs.
+
+Imported lazily by tce_monitor, so state-only commands never load Playwright.
+"""
+import calendar
+import json
+import os
+import logging
+import random
+import time
+from datetime import timedelta
+import re
+from urllib.parse import urljoin, urlsplit
+import config
+import metrics
+from tce_monitor import (
+    _api_image, _extract_event_list, _fingerprint_events, _split_window, _window, _window_dates, _window_key,
+    load_checkpoint, plan_windows, save_checkpoint_window, save_window_plan,
+)
+
+try:
+    from playwright.sync_api import sync_playwright, Error as PlaywrightError, TimeoutError as PlaywrightTimeout
+except ImportError:
+    sync_playwright = None
+    PlaywrightError = PlaywrightTimeout = Exception
+    logging.warning("Playwright not found. Install with: pip install playwright && playwright install chromium")
+
+
+_BROWSER_ARGS = [
+    '--disable-blink-features=AutomationControlled',
+    '--disable-infobars',
+    '--no-first-run',
+    '--no-default-browser-check',
+]
+
+# Patch automation detection before any page script runs
+_INIT_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+    Object.defineProperty(navigator, 'plugins', {get: () => [1, 2, 3, 4, 5]});
+    Object.defineProperty(navigator, 'languages', {get: () => ['ru-RU', 'ru', 'en-US', 'en']});
+    window.chrome = {runtime: {}};
+"""
+
+# One POST per month window — reuses the same Anubis-cleared session.
+# Failures come back as {_error}; those meaning the page is not (or no longer) cleared —
+# a challenge page, HTML instead of JSON, a failed fetch — also carry _rejected
+_JS_POST_WINDOW = """
+    async function postWindow(w) {
+        try {
+            const body = new URLSearchParams({
+                bk_id: '', date_begin: w.date_begin, date_end: w.date_end,
+                tags: '', server_key: w.server_key,
+                loc_id: '0', hall_id: '0', order_id: '0', type: ''
+            }).toString();
+            const r = await fetch('/index.php?view=shows&action=find&kind=text', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/x-www-form-urlencoded',
+                    'Accept': 'application/json, text/javascript, */*; q=0.01',
+                    'X-Requested-With': 'XMLHttpRequest'
+                },
+                body: body
+            });
+            const text = await r.text();
+            const challenge = text.includes('anubis_challenge');
+            if (!r.ok) return challenge ? {_error: r.status, _rejected: true} : {_error: r.status};
+            if (!text.trim()) return {_error: 'empty response'};
+            try { return JSON.parse(text); } catch(e) {
+                return text.trimStart().startsWith('<') ? {_error: 'HTML instead of JSON', _rejected: true}
+                                                         : {_error: 'unparseable response'};
+            }
+        } catch(e) { return {_error: e.toString(), _rejected: true}; }
+    }
+"""
+
+_JS_FETCH = "async (args) => {" + _JS_POST_WINDOW + "return await postWindow(args); }"
+
+# Concurrent variant: a small in-page worker pool, results returned in window order
+_JS_FETCH_MANY = "async (args) => {" + _JS_POST_WINDOW + """
+    const results = new Array(args.windows.length);
+    let next = 0;
+    const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+    async function worker() {
+        while (next < args.windows.length) {
+            const i = next++;
+            if (args.jitter_ms > 0) await sleep(Math.random() * args.jitter_ms);
+            results[i] = await postWindow(args.windows[i]);
+        }
+    }
+    const size = Math.max(1, Math.min(args.concurrency, args.windows.length));
+    await Promise.all(Array.from({length: size}, worker));
+    return results;
+}"""
+
+
+# Show pages fetched through the cleared page by the same kind of bounded in-page pool
+_JS_GET_PAGES = """async (args) => {
+    const results = new Array(args.urls.length);
+    let next = 0;
+    async function worker() {
+        while (next < args.urls.length) {
+            const i = next++;
+            try {
+                const r = await fetch(args.urls[i], {headers: {'Accept': 'text/html'}});
+                results[i] = r.ok ? await r.text() : '';
+            } catch(e) { results[i] = ''; }
+        }
+    }
+    const size = Math.max(1, Math.min(args.concurrency, args.urls.length));
+    await Promise.all(Array.from({length: size}, worker));
+    return results;
+}"""
+
+_POSTER_META_RE = re.compile(
+    r'<meta[^>]+(?:property|name)=["\'](?:og:image|twitter:image)["\'][^>]*content=["\']([^"\']+)', re.I)
+
+
+def _lookup_posters(page, theatres, windows_by_theatre) -> None:
+    """
+    Record poster URLs for shows the poster cache has not seen yet, one show page per
+    distinct title (at most TCE_POSTER_LOOKUPS_PER_RUN per run). Titles whose API items
+    already carry an image are recorded without a page fetch.
+    """
+    from posters import get_poster_cache
+    cache = get_poster_cache()
+    candidates = {}
+    for theatre in theatres:
+        for w in windows_by_theatre.get(theatre['name'], []):
+            for e in w['events']:
+                candidates.setdefault(e.get('show_name'), (theatre, e))
+    missing = cache.missing_titles(candidates)
+    if not missing:
+        return
+    known = {t: _api_image(candidates[t][1]) for t in missing if _api_image(candidates[t][1])}
+    todo = [t for t in missing if t not in known][:config.TCE_POSTER_LOOKUPS_PER_RUN]
+    if todo:
+        urls = [f"{config.TCE_BASE_URL}?base={candidates[t][0]['server_key']}&data={candidates[t][1]['bk_id']}"
+                for t in todo]
+        with metrics.phase('poster_lookup', pages=len(urls)):
+            pages = page.evaluate(_JS_GET_PAGES, {'urls': urls, 'concurrency': config.TCE_FETCH_CONCURRENCY})
+        for title, html_text in zip(todo, pages):
+            match = _POSTER_META_RE.search(html_text or '')
+            known[title] = urljoin(config.TCE_ORIGIN + '/', match.group(1)) if match else ''
+    cache.remember_titles(known)
+    cache.save()
+    logging.info(f"Poster lookup: {sum(1 for u in known.values() if u)}/{len(known)} new show(s) have a poster"
+                 + (f", {len(missing) - len(known)} left for later runs" if len(missing) > len(known) else ''))
+
+
+def load_session_state():
+    """
+    Load the stored Playwright storage state (cookies + local storage) for tce.by.
+    Returns (storage_state, cleared_at) or (None, None) when missing or expired.
+    """
+    if not os.path.exists(config.TCE_SESSION_FILE):
+        logging.info("No stored tce.by session")
+        return None, None
+    try:
+        with open(config.TCE_SESSION_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        cleared_at = float(data['cleared_at'])
+        state = data['storage_state']
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable session file: {e}")
+        return None, None
+
+    age = time.time() - cleared_at
+    if age > config.TCE_SESSION_TTL:
+        logging.info(f"Stored tce.by session expired ({age / 3600:.1f}h old)")
+        return None, None
+    if not state.get('cookies'):
+        logging.info("Stored tce.by session has no cookies")
+        return None, None
+    return state, cleared_at
+
+
+def save_session_state(context, cleared_at=None) -> None:
+    """Persist the context's storage state so the next run can skip the clearance navigation."""
+    try:
+        os.makedirs(os.path.dirname(config.TCE_SESSION_FILE), exist_ok=True)
+        data = {
+            'cleared_at': cleared_at if cleared_at is not None else time.time(),
+            'storage_state': context.storage_state(),
+        }
+        tmp = config.TCE_SESSION_FILE + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp, config.TCE_SESSION_FILE)
+        logging.info(f"Saved tce.by session to {config.TCE_SESSION_FILE}")
+    except Exception as e:
+        logging.error(f"Error saving tce.by session: {e}")
+
+
+def discard_session_state() -> None:
+    """Delete the stored session (used when the server rejects it)."""
+    try:
+        os.remove(config.TCE_SESSION_FILE)
+    except FileNotFoundError:
+        pass
+
+
+class ResourcePolicy:
+    """
+    Playwright routing rule that aborts requests clearance does not need: resource types in
+    TCE_BLOCK_RESOURCE_TYPES (images, fonts, media by default) and, with TCE_BLOCK_THIRD_PARTY,
+    any host outside the tce.by origin and TCE_ALLOWED_HOSTS. Same-origin documents, scripts
+    and the search-API fetches always go through.
+
+    Aborted requests never report a size. While the policy is off, the responses it would have
+    blocked are measured instead (content-length per reason, accumulated in
+    TCE_RESOURCE_SIZES_FILE); with it on, blocked counts × those averages estimate the bytes saved.
+    """
+
+    def __init__(self):
+        self.enabled = config.TCE_RESOURCE_POLICY
+        self.block_types = set(config.TCE_BLOCK_RESOURCE_TYPES)
+        origin_host = urlsplit(config.TCE_ORIGIN).hostname or ''
+        self.allowed_hosts = {origin_host, *config.TCE_ALLOWED_HOSTS}
+        self.sizes = self._load_sizes()
+        self.reset()
+
+    def reset(self) -> None:
+        self.stats = {'allowed': 0, 'allowed_bytes': 0, 'blocked': 0, 'blocked_by': {}, 'measured': {}}
+
+    @staticmethod
+    def _load_sizes() -> dict:
+        """{reason: {'requests', 'bytes'}} measured with the policy off; {} when none yet."""
+        try:
+            with open(config.TCE_RESOURCE_SIZES_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable resource sizes file: {e}")
+            return {}
+
+    def _save_sizes(self) -> None:
+        for reason, (requests, size) in self.stats['measured'].items():
+            entry = self.sizes.setdefault(reason, {'requests': 0, 'bytes': 0})
+            entry['requests'] += requests
+            entry['bytes'] += size
+        try:
+            os.makedirs(os.path.dirname(config.TCE_RESOURCE_SIZES_FILE), exist_ok=True)
+            tmp = config.TCE_RESOURCE_SIZES_FILE + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.sizes, f, indent=2, sort_keys=True)
+            os.replace(tmp, config.TCE_RESOURCE_SIZES_FILE)
+        except Exception as e:
+            logging.error(f"Error saving resource sizes: {e}")
+
+    def _estimate_saved(self):
+        """(estimated bytes saved, reasons blocked this run with no measured size)."""
+        saved, unknown = 0, []
+        for reason, count in sorted(self.stats['blocked_by'].items()):
+            entry = self.sizes.get(reason)
+            if entry and entry['requests']:
+                saved += count * entry['bytes'] // entry['requests']
+            else:
+                unknown.append(reason)
+        return saved, unknown
+
+    def _is_first_party(self, url: str) -> bool:
+        host = urlsplit(url).hostname or ''
+        return any(host == h or host.endswith('.' + h) for h in self.allowed_hosts if h)
+
+    def attach(self, context) -> None:
+        if self.enabled:
+            context.route('**/*', self._handle)
+        context.on('response', self._on_response)
+
+    def _reason(self, request):
+        """Why the policy blocks this request (resource type or 'third-party'), or None."""
+        if request.resource_type in self.block_types:
+            return request.resource_type
+        if config.TCE_BLOCK_THIRD_PARTY and not self._is_first_party(request.url):
+            return 'third-party'
+        return None
+
+    def _handle(self, route) -> None:
+        reason = self._reason(route.request)
+        if reason is None:
+            self.stats['allowed'] += 1
+            route.continue_()
+            return
+        self.stats['blocked'] += 1
+        self.stats['blocked_by'][reason] = self.stats['blocked_by'].get(reason, 0) + 1
+        route.abort('blockedbyclient')
+
+    def _on_response(self, response) -> None:
+        try:
+            size = int(response.headers.get('content-length') or 0)
+        except ValueError:
+            return
+        if self.enabled:
+            self.stats['allowed_bytes'] += size
+            return
+        reason = self._reason(response.request)
+        if reason is not None and size:  # chunked responses report no size and are not sampled
+            requests, total = self.stats['measured'].get(reason, (0, 0))
+            self.stats['measured'][reason] = (requests + 1, total + size)
+
+    def log_and_reset(self) -> None:
+        """
+        Log this run's blocked requests and estimated savings, add them to the run metrics and
+        start counting afresh. With the policy off, store the sizes measured for the estimate.
+        """
+        s = self.stats
+        if not self.enabled:
+            if s['measured']:
+                self._save_sizes()
+            self.reset()
+            return
+        reasons = ', '.join(f"{k} {v}" for k, v in sorted(s['blocked_by'].items())) or 'nothing'
+        saved, unknown = self._estimate_saved()
+        estimate = f"~{saved / 1024:.0f} KiB saved"
+        if unknown:
+            estimate += f" (no size measured for {', '.join(unknown)}; run once with TCE_RESOURCE_POLICY=false)"
+        logging.info(f"Resource policy: blocked {s['blocked']} request(s) ({reasons}), {estimate}; "
+                     f"{s['allowed']} allowed, {s['allowed_bytes'] / 1024:.0f} KiB transferred")
+        metrics.incr('blocked_requests', s['blocked'])
+        metrics.incr('blocked_bytes_estimate', saved)
+        metrics.incr('browser_transferred_bytes', s['allowed_bytes'])
+        self.reset()
+
+
+def _new_page(browser, storage_state=None, policy=None):
+    """Create a fresh context + page with the shared browser fingerprint (and resource policy)."""
+    context = browser.new_context(
+        user_agent=config.USER_AGENT,
+        viewport={'width': 1920, 'height': 1080},
+        locale='ru-RU',
+        color_scheme='light',
+        has_touch=False,
+        is_mobile=False,
+        storage_state=storage_state,
+        extra_http_headers={
+            "Accept-Language": config.ACCEPT_LANGUAGE,
+            "DNT": "1",
+            "Upgrade-Insecure-Requests": "1",
+        }
+    )
+    if policy is not None:
+        policy.attach(context)
+    page = context.new_page()
+    page.add_init_script(_INIT_SCRIPT)
+    return context, page
+
+
+class ClearanceError(RuntimeError):
+    """Anubis clearance did not complete within TCE_CLEARANCE_TIMEOUT."""
+
+
+_JS_CHALLENGE_PRESENT = "() => !!document.getElementById('anubis_challenge')"
+
+
+def _clearance_signals(page) -> dict:
+    """Current readiness signals: clearance cookie set, challenge page still showing."""
+    cookie = any(config.TCE_CLEARANCE_COOKIE in c['name'] for c in page.context.cookies())
+    try:
+        challenge = page.evaluate(_JS_CHALLENGE_PRESENT)
+    except Exception:
+        challenge = True  # mid-reload: the execution context was replaced under us
+    return {'cookie': cookie, 'challenge': challenge}
+
+
+def _wait_for_clearance(page, probe_window):
+    """
+    Wait until Anubis has cleared the page, then confirm with one probe POST.
+    Ready as soon as the clearance cookie appears or the challenge page is gone and the probe
+    is not rejected (see _is_rejected). Returns the probe's response, the first window's chunk,
+    which may be an ordinary failed window (e.g. HTTP 500) left to the per-window error
+    handling. Raises ClearanceError after TCE_CLEARANCE_TIMEOUT seconds.
+    """
+    started = time.monotonic()
+    deadline = started + config.TCE_CLEARANCE_TIMEOUT
+    next_probe = started
+    signals = {}
+    while time.monotonic() < deadline:
+        signals = _clearance_signals(page)
+        if (signals['cookie'] or not signals['challenge']) and time.monotonic() >= next_probe:
+            metrics.incr('clearance_probes')
+            try:
+                chunk = page.evaluate(_JS_FETCH, probe_window)
+            except Exception as e:
+                chunk = {'_error': str(e), '_rejected': True}
+            if not _is_rejected(chunk):
+                _record_window({}, chunk)
+                logging.info(f"Clearance ready after {time.monotonic() - started:.1f}s "
+                             f"(cookie={'yes' if signals['cookie'] else 'no'})")
+                if _is_error(chunk):
+                    logging.warning(f"  First window failed ({chunk['_error']}) — handled as a failed window")
+                return chunk
+            next_probe = time.monotonic() + 1.0  # cleared-looking but rejected: do not hammer
+        page.wait_for_timeout(250)
+    raise ClearanceError(
+        f"Anubis clearance did not complete within {config.TCE_CLEARANCE_TIMEOUT}s "
+        f"(clearance cookie: {'set' if signals.get('cookie') else 'missing'}, "
+        f"challenge page: {'still showing' if signals.get('challenge') else 'gone'})"
+    )
+
+
+def _clear_challenge(page, probe_window):
+    """
+    Full navigation: homepage → search.html, letting Anubis issue its clearance cookie.
+    Returns the probe window's response once clearance is confirmed (see _wait_for_clearance).
+    """
+    # Land on homepage first — natural entry point, establishes session
+    logging.info("Navigating to tce.by homepage...")
+    with metrics.phase('homepage_nav'):
+        page.goto(f"{config.TCE_ORIGIN}/", wait_until='networkidle',
+                  timeout=config.BROWSER_TIMEOUT * 1000)
+    page.mouse.move(random.randint(200, 1200), random.randint(150, 700))
+    time.sleep(random.uniform(0.3, 1.0))  # brief think-time before moving on
+
+    # Navigate to search page — triggers Anubis clearance
+    logging.info("Navigating to tce.by/search.html...")
+    with metrics.phase('search_nav'):
+        page.goto(f"{config.TCE_ORIGIN}/search.html", wait_until='domcontentloaded',
+                  timeout=config.BROWSER_TIMEOUT * 1000)
+    with metrics.phase('clearance_wait'):
+        chunk = _wait_for_clearance(page, probe_window)
+
+    # Simulate natural user interaction
+    page.evaluate(f"window.scrollBy(0, {random.randint(150, 400)})")
+    page.mouse.move(random.randint(200, 1200), random.randint(150, 700))
+    return chunk
+
+
+def _record_window(record, chunk) -> None:
+    """Add a window response's event count, payload size and status to a metrics record."""
+    metrics.incr('window_posts')
+    if _is_error(chunk):
+        record['ok'] = False
+        metrics.incr('window_errors')
+        return
+    record['events'] = len(_extract_event_list(chunk))
+    record['payload_bytes'] = len(json.dumps(chunk, ensure_ascii=False).encode('utf-8'))
+    metrics.incr('payload_bytes', record['payload_bytes'])
+
+
+def _fetch_window(page, m):
+    """POST one date window from inside the page. Returns the raw response (may carry `_error`)."""
+    logging.info(f"Fetching {m['theatre']} events {m['date_begin']} → {m['date_end']}")
+    with metrics.phase('window_post', theatre=m['theatre'], window=_window_key(m)) as record:
+        chunk = page.evaluate(_JS_FETCH, m)
+        _record_window(record, chunk)
+    return chunk
+
+
+def _fetch_windows_concurrently(page, windows) -> list:
+    """POST several date windows in parallel (bounded by TCE_FETCH_CONCURRENCY), in window order."""
+    if not windows:
+        return []
+    logging.info(f"Fetching {len(windows)} windows concurrently "
+                 f"(concurrency={config.TCE_FETCH_CONCURRENCY}, jitter≤{config.TCE_FETCH_JITTER_MS}ms)")
+    with metrics.phase('window_batch', windows=[]) as batch:
+        chunks = page.evaluate(_JS_FETCH_MANY, {
+            'windows': windows,
+            'concurrency': config.TCE_FETCH_CONCURRENCY,
+            'jitter_ms': config.TCE_FETCH_JITTER_MS,
+        })
+        # Per-window latency is not visible from here; record counts and sizes under the batch
+        for m, chunk in zip(windows, chunks):
+            record = {'theatre': m['theatre'], 'window': _window_key(m), 'ok': True}
+            _record_window(record, chunk)
+            batch['windows'].append(record)
+    return chunks
+
+
+def _is_error(chunk) -> bool:
+    return isinstance(chunk, dict) and '_error' in chunk
+
+
+def _is_rejected(chunk) -> bool:
+    """The response shows the page is not cleared (challenge/HTML, or the fetch itself failed)."""
+    return _is_error(chunk) and bool(chunk.get('_rejected'))
+
+
+def _iter_window_chunks(page, windows, prefetched=()):
+    """
+    Yield (window, raw_response) in date order, starting with the already-fetched
+    responses in `prefetched` (aligned with the first windows).
+    Sequential mode fetches the rest lazily with think-time, so stopping iteration skips
+    later windows; concurrent mode fetches them all up front (later windows are speculative).
+    """
+    yield from zip(windows, prefetched)
+    pending = windows[len(prefetched):]
+
+    if config.TCE_CONCURRENT_FETCH:
+        yield from zip(pending, _fetch_windows_concurrently(page, pending))
+        return
+
+    for i, m in enumerate(pending):
+        if i > 0 or prefetched:
+            time.sleep(random.uniform(1.5, 4.0))  # think-time between API calls
+        yield m, _fetch_window(page, m)
+
+
+def _resolve_capped(page, m, chunk) -> list:
+    """
+    Turn one window's response into [(window, events or None)], splitting the window in
+    half and re-fetching whenever the response hits TCE_API_RESULT_CAP (i.e. may be truncated).
+    """
+    if _is_error(chunk):
+        logging.error(f"API error for {m['date_begin']}: {chunk}")
+        return [(m, None)]
+    events = _extract_event_list(chunk)
+    if len(events) < config.TCE_API_RESULT_CAP:
+        return [(m, events)]
+
+    halves = _split_window(m)
+    if halves is None:
+        logging.warning(f"  {m['date_begin']}: single-day window hit the {config.TCE_API_RESULT_CAP}-result cap — "
+                        f"results may be truncated")
+        return [(m, events)]
+    logging.info(f"  {m['date_begin']} → {m['date_end']}: hit the {config.TCE_API_RESULT_CAP}-result cap, splitting")
+    metrics.incr('window_splits')
+    if config.TCE_CONCURRENT_FETCH:
+        chunks = _fetch_windows_concurrently(page, halves)
+    else:
+        chunks = []
+        for h in halves:
+            time.sleep(random.uniform(1.5, 4.0))
+            chunks.append(_fetch_window(page, h))
+    resolved = []
+    for h, c in zip(halves, chunks):
+        resolved.extend(_resolve_capped(page, h, c))
+    return resolved
+
+
+def _spans_calendar_month(w) -> bool:
+    """
+    True when the window contains a whole calendar month. Only such an empty window ends a
+    theatre's fetch: a short adaptive window (or the rest of the current month) can be empty
+    on dark days with shows right after it.
+    """
+    begin, end = _window_dates(w)
+    first = begin if begin.day == 1 else (begin.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return first.replace(day=calendar.monthrange(first.year, first.month)[1]) <= end
+
+
+def _fetch_windows(page, windows, prefetched=(), on_window=None):
+    """
+    Fetch one theatre's date windows in order, deduplicating by bk_id and stopping at the
+    first empty window that spans a whole calendar month (the rest is not fetched).
+    Returns (events, observed) where observed lists each fetched window with its event count
+    (None for errors), its response fingerprint and its share of the deduplicated events —
+    the input for save_window_plan() and the fingerprint short-circuit.
+    `on_window(window, entries)` is called for each planned window fetched without errors.
+    """
+    all_events = []
+    seen_ids = set()
+    observed = []
+    for i, (w, chunk) in enumerate(_iter_window_chunks(page, windows, prefetched)):
+        resolved = _resolve_capped(page, w, chunk)
+        empty = all(events is not None and len(events) == 0 for _, events in resolved)
+        first = len(observed)
+        for m, events in resolved:
+            window = {**_window(*_window_dates(m)), 'count': None, 'fingerprint': None, 'events': []}
+            observed.append(window)
+            if events is None:
+                continue
+            logging.info(f"  [{m['theatre']}] {m['date_begin']} → {m['date_end']}: {len(events)} events")
+            window['count'] = len(events)
+            window['fingerprint'] = _fingerprint_events(events)
+            for e in events:
+                if e.get('bk_id') not in seen_ids:
+                    seen_ids.add(e['bk_id'])
+                    all_events.append(e)
+                    window['events'].append(e)
+        empty = empty and _spans_calendar_month(w)
+        if empty:
+            skipped = len(windows) - i - 1
+            if config.TCE_CONCURRENT_FETCH and skipped:
+                logging.info(f"  [{w['theatre']}] Empty window — stopping early, "
+                             f"discarding {skipped} speculative window(s)")
+            else:
+                logging.info(f"  [{w['theatre']}] Empty window — stopping early")
+        if on_window and all(events is not None for _, events in resolved):
+            on_window(w, observed[first:])
+        if empty:
+            break
+    return all_events, observed
+
+
+class TceBrowserSession:
+    """
+    A Playwright browser with an Anubis-cleared page that can be reused across polls.
+
+    One-shot runs open and close a session per fetch; daemon mode keeps a single
+    session alive and only rebuilds it after failures or DAEMON_MAX_CYCLES polls.
+    """
+
+    def __init__(self):
+        self._playwright = None
+        self.browser = None
+        self.context = None
+        self.page = None
+        self.cleared_at = None
+        self.cycles = 0
+        self.policy = ResourcePolicy()
+
+    @property
+    def is_open(self) -> bool:
+        return self.browser is not None
+
+    def open(self) -> None:
+        if self.is_open:
+            return
+        if sync_playwright is None:
+            raise RuntimeError("Playwright is not installed: pip install playwright && playwright install chromium")
+        logging.info("Launching Chromium...")
+        with metrics.phase('browser_launch'):
+            self._playwright = sync_playwright().start()
+            self.browser = self._playwright.chromium.launch(headless=config.USE_HEADLESS, args=_BROWSER_ARGS)
+        self.cycles = 0
+
+    def close(self) -> None:
+        """Tear down the browser; safe to call on an already-closed or half-built session."""
+        for closer in (lambda: self.browser.close(), lambda: self._playwright.stop()):
+            try:
+                closer()
+            except Exception:
+                pass
+        self._playwright = self.browser = self.context = self.page = None
+        self.cleared_at = None
+
+    def _drop_page(self) -> None:
+        try:
+            self.context.close()
+        except Exception:
+            pass
+        self.context = self.page = None
+
+    def _probe(self, window):
+        """
+        POST the first window from the current page; returns the chunk, or None when the
+        page is not cleared (see _is_rejected). Any other error is returned as the first
+        window's failed chunk and leaves the session in place.
+        """
+        try:
+            chunk = _fetch_window(self.page, window)
+        except PlaywrightError as e:  # timeout, closed page, destroyed execution context
+            chunk = {'_error': str(e), '_rejected': True}
+        if _is_rejected(chunk):
+            logging.warning(f"Clearance rejected ({chunk['_error']})")
+            return None
+        if _is_error(chunk):
+            logging.warning(f"First window failed ({chunk['_error']}) — session kept, handled as a failed window")
+        return chunk
+
+    def _ensure_cleared(self, first_window):
+        """
+        Make sure self.page is on an Anubis-cleared tce.by page.
+        Returns the first window's chunk, which every path fetches as its probe.
+        """
+        # Warm path: page from a previous poll in this process
+        if self.page is not None:
+            chunk = self._probe(first_window)
+            if chunk is not None:
+                logging.info("Session path: warm-browser")
+                metrics.incr('session_warm_browser')
+                return chunk
+            self._drop_page()
+
+        # Fast path: reuse a stored clearance and go straight to the month POSTs.
+        # The first month doubles as a probe — a challenge or HTML response means the clearance was rejected.
+        stored_state, cleared_at = load_session_state()
+        if stored_state:
+            self.context, self.page = _new_page(self.browser, storage_state=stored_state,
+                                                policy=self.policy)
+            try:
+                self.page.goto(f"{config.TCE_ORIGIN}/search.html", wait_until='domcontentloaded',
+                               timeout=config.BROWSER_TIMEOUT * 1000)
+                chunk = self._probe(first_window)
+            except PlaywrightError as e:
+                logging.warning(f"Stored session navigation failed: {e}")
+                chunk = None
+            if chunk is not None:
+                self.cleared_at = cleared_at
+                logging.info("Session path: stored-session")
+                metrics.incr('session_stored')
+                return chunk
+            logging.warning("Stored tce.by session rejected — falling back to full navigation")
+            discard_session_state()
+            self._drop_page()
+
+        self.context, self.page = _new_page(self.browser, policy=self.policy)
+        chunk = _clear_challenge(self.page, first_window)
+        self.cleared_at = time.time()
+        logging.info("Session path: full-navigation")
+        metrics.incr('session_full_navigation')
+        return chunk
+
+    def fetch(self, plans, on_window=None):
+        """
+        Fetch several theatres' window plans through the one cleared page, clearing first if needed.
+        In concurrent mode every theatre's first-round windows share one bounded in-page pool.
+        Returns one (events, observed) pair per plan, as _fetch_windows() does;
+        `on_window(plan index, window, entries)` is called as each window completes.
+        """
+        self.open()
+        prefetched = [[] for _ in plans]
+        with metrics.phase('clearance'):
+            first_chunk = self._ensure_cleared(plans[0][0])
+        if first_chunk is not None:
+            prefetched[0].append(first_chunk)
+
+        if config.TCE_CONCURRENT_FETCH:
+            rest = [(gi, w) for gi, windows in enumerate(plans) for w in windows[len(prefetched[gi]):]]
+            chunks = _fetch_windows_concurrently(self.page, [w for _, w in rest])
+            for (gi, _), chunk in zip(rest, chunks):
+                prefetched[gi].append(chunk)
+
+        results = []
+        for gi, (windows, pre) in enumerate(zip(plans, prefetched)):
+            if gi > 0 and not config.TCE_CONCURRENT_FETCH:
+                time.sleep(random.uniform(1.5, 4.0))  # think-time between theatres
+            callback = (lambda w, entries, gi=gi: on_window(gi, w, entries)) if on_window else None
+            results.append(_fetch_windows(self.page, windows, prefetched=pre, on_window=callback))
+        save_session_state(self.context, cleared_at=self.cleared_at)
+        self.policy.log_and_reset()
+        self.cycles += 1
+        return results
+
+
+def _covered(w, entries) -> bool:
+    return any(e['date_begin'] <= w['date_begin'] and w['date_end'] <= e['date_end'] for e in entries)
+
+
+def _merge_resumed(resumed_entries, observed) -> list:
+    """
+    Combine checkpointed windows with this run's fetches, in date order. Events fetched
+    now win over checkpointed copies of the same bk_id (a show may have moved windows).
+    """
+    fresh_ids = {e['bk_id'] for w in observed for e in w['events']}
+    merged = list(observed)
+    for w in resumed_entries:
+        merged.append({**w, 'events': [e for e in w['events'] if e['bk_id'] not in fresh_ids]})
+    return sorted(merged, key=lambda w: w['date_begin'])
+
+
+def _fetch_search_api_with_playwright(theatres, session=None, on_window=None) -> dict:
+    """
+    Navigate to tce.by via Playwright (Anubis bypass), call search API from browser context
+    for every theatre. Returns {theatre name: fetched windows} (see _fetch_windows).
+    A caller-owned `session` is left open for reuse; otherwise a one-shot session is used.
+
+    Every window fetched without errors is checkpointed next to the theatre's state file. A
+    follow-up run within TCE_CHECKPOINT_TTL only fetches the windows that are missing, and
+    needs no browser at all when the checkpoint already covers every window.
+    `on_window(theatre, window, entries)` is called (after checkpointing) as each window
+    completes without errors, while later windows are still being fetched.
+    """
+    plans, resumed = [], []
+    for theatre in theatres:
+        windows = plan_windows(theatre)
+        done = load_checkpoint(theatre['state_file'])
+        done_entries = [e for key, entries in done.items() for e in entries]
+        pending = [w for w in windows if _window_key(w) not in done and not _covered(w, done_entries)]
+        if done:
+            logging.info(f"[{theatre['name']}] Resuming from checkpoint: "
+                         f"{len(windows) - len(pending)}/{len(windows)} window(s) already fetched")
+        plans.append(pending)
+        resumed.append(done_entries)
+    active = [i for i, plan in enumerate(plans) if plan]
+
+    def checkpoint(ai, w, entries):
+        theatre = theatres[active[ai]]
+        save_checkpoint_window(theatre['state_file'], _window_key(w), entries)
+        if on_window:
+            on_window(theatre, w, entries)
+
+    results = [([], []) for _ in theatres]
+    if active:
+        owned = session is None
+        if owned:
+            session = TceBrowserSession()
+        try:
+            for ai, result in zip(active, session.fetch([plans[i] for i in active], on_window=checkpoint)):
+                results[ai] = result
+            if config.TCE_POSTERS:
+                try:  # posters are best-effort; never fail the run over them
+                    _lookup_posters(session.page, theatres, {t['name']: r[1] for t, r in zip(theatres, results)})
+                except Exception as e:
+                    logging.warning(f"Poster lookup failed: {e}")
+        except PlaywrightTimeout as e:
+            logging.error(f"Playwright timeout fetching search API (completed windows are checkpointed): {e}")
+            raise
+        except Exception as e:
+            logging.error(f"Error fetching search API with Playwright (completed windows are checkpointed): {e}")
+            raise
+        finally:
+            if owned:
+                session.close()
+    else:
+        logging.info("Every window is covered by a fresh checkpoint — no browser needed")
+
+    windows_by_theatre = {}
+    for theatre, (_, observed), done_entries in zip(theatres, results, resumed):
+        observed = _merge_resumed(done_entries, observed) if done_entries else observed
+        failed = sum(1 for w in observed if w['count'] is None)
+        if failed:
+            # Keep the plan as is, so the retry's window keys still match the checkpoint
+            logging.warning(f"[{theatre['name']}] {failed}/{len(observed)} window(s) failed — "
+                            f"a re-run within {config.TCE_CHECKPOINT_TTL}s fetches only those")
+        else:
+            save_window_plan(observed, theatre['plan_file'])
+        logging.info(f"[{theatre['name']}] Total unique events across {len(observed)} window(s): "
+                     f"{sum(len(w['events']) for w in observed)}")
+        windows_by_theatre[theatre['name']] = observed
+    return windows_by_theatre
@@ -1,45 +1,304 @@
 """Module for monitoring TCE.BY events via search API with Anubis bypass"""
+import hashlib
+import html
 import json
 import os
 import logging
-import random
+import re
 import time
 import calendar
-from datetime import datetime, date as _date
-import requests
+import queue
+import threading
+from functools import lru_cache
+from datetime import datetime, timedelta, date as _date
 import config
+import metrics
+from id_ranges import IdRangeSet, load_id_state, save_id_state
 
-try:
-    from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeout
-except ImportError:
-    sync_playwright = None
-    PlaywrightTimeout = Exception
-    logging.warning("Playwright not found. Install with: pip install playwright && playwright install chromium")
+# The Playwright backend (tce_fetch), the Telegram client (requests) and the SQLite store
+# are imported on first use, so state-only commands and --help start fast.
+_FETCH_EXPORTS = ('TceBrowserSession', 'load_session_state', 'save_session_state', 'discard_session_state')
 
 
-def load_processed_ids() -> set:
-    """Load set of already-processed event IDs from tce_processed_ids.json"""
-    if os.path.exists(config.TCE_PROCESSED_IDS_FILE):
+def __getattr__(name):
+    """Keep tce_monitor.TceBrowserSession & co. importable without loading Playwright up front."""
+    if name in _FETCH_EXPORTS:
+        import tce_fetch
+        return getattr(tce_fetch, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _resolve_path(path: str) -> str:
+    return path if os.path.isabs(path) else os.path.join(config.BASE_DIR, path)
+
+
+def load_theatres() -> list:
+    """
+    Load the theatres to monitor from TCE_THEATRES_FILE (a JSON list), filling in defaults.
+    Without the file a single 'puppet' theatre is built from the legacy config constants,
+    keeping its original state file paths.
+    """
+    if not os.path.exists(config.TCE_THEATRES_FILE):
+        return [{
+            'name': 'puppet',
+            'server_key': config.TCE_BASE_PARAM,
+            'chat_id': config.TELEGRAM_CHAT_ID,
+            'test_chat_id': config.TEST_TELEGRAM_CHAT_ID,
+            'channel_username': config.TELEGRAM_CHANNEL_USERNAME,
+            'test_channel_username': config.TEST_TELEGRAM_CHANNEL_USERNAME,
+            'months_ahead': config.TCE_MONTHS_AHEAD,
+            'state_file': config.TCE_PROCESSED_IDS_FILE,
+            'plan_file': config.TCE_WINDOW_PLAN_FILE,
+        }]
+
+    with open(config.TCE_THEATRES_FILE, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    theatres = []
+    for entry in entries:
+        if not entry.get('name') or not entry.get('server_key'):
+            raise ValueError(f"Theatre entry needs 'name' and 'server_key': {entry}")
+        name = entry['name']
+        theatres.append({
+            'name': name,
+            'server_key': entry['server_key'],
+            'chat_id': entry.get('chat_id', config.TELEGRAM_CHAT_ID),
+            'test_chat_id': entry.get('test_chat_id', config.TEST_TELEGRAM_CHAT_ID),
+            'channel_username': entry.get('channel_username', config.TELEGRAM_CHANNEL_USERNAME),
+            'test_channel_username': entry.get('test_channel_username', config.TEST_TELEGRAM_CHANNEL_USERNAME),
+            'months_ahead': int(entry.get('months_ahead', config.TCE_MONTHS_AHEAD)),
+            'state_file': _resolve_path(entry.get('state_file',
+                                                  os.path.join(config.DATA_DIR, f"tce_processed_ids_{name}.json"))),
+            'plan_file': _resolve_path(entry.get('plan_file',
+                                                 os.path.join(config.DATA_DIR, f"tce_window_plan_{name}.json"))),
+        })
+    if len({t['name'] for t in theatres}) != len(theatres):
+        raise ValueError(f"Duplicate theatre names in {config.TCE_THEATRES_FILE}")
+    logging.info(f"Loaded {len(theatres)} theatre(s) from {config.TCE_THEATRES_FILE}")
+    return theatres
+
+
+def load_processed_ids(path=None) -> IdRangeSet:
+    """
+    Load the already-processed event IDs from tce_processed_ids.json (or a theatre's state file)
+    as a range-encoded set. Legacy list-format files are read transparently.
+    """
+    path = path or config.TCE_PROCESSED_IDS_FILE
+    if os.path.exists(path):
         try:
-            with open(config.TCE_PROCESSED_IDS_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                ids = set(data.get('processed_ids', []))
-                logging.info(f"Loaded {len(ids)} processed event IDs")
-                return ids
+            ids = load_id_state(path)
+            logging.info(f"Loaded {len(ids)} processed event IDs ({len(ids.ranges())} ranges)")
+            return ids
         except Exception as e:
             logging.error(f"Error loading processed IDs: {e}")
-    return set()
+    return IdRangeSet()
 
 
-def save_processed_ids(ids: set) -> None:
-    """Save set of processed event IDs to tce_processed_ids.json"""
+def save_processed_ids(ids, path=None) -> bool:
+    """Save processed event IDs to tce_processed_ids.json (or a theatre's state file) in range format"""
+    path = path or config.TCE_PROCESSED_IDS_FILE
     try:
-        os.makedirs(os.path.dirname(config.TCE_PROCESSED_IDS_FILE), exist_ok=True)
-        with open(config.TCE_PROCESSED_IDS_FILE, 'w', encoding='utf-8') as f:
-            json.dump({'processed_ids': sorted(ids)}, f, indent=2)
+        save_id_state(ids, path)
         logging.info(f"Saved {len(ids)} processed event IDs")
+        return True
     except Exception as e:
         logging.error(f"Error saving processed IDs: {e}")
+        return False
+
+
+def _sidecar_path(state_file: str, kind: str) -> str:
+    """Path of a file stored next to a theatre's state file, e.g. tce_processed_ids.fingerprints.json."""
+    base, ext = os.path.splitext(state_file)
+    return f"{base}.{kind}{ext or '.json'}"
+
+
+def _fingerprint_events(events) -> str:
+    """Hash a window's events independent of response order and key order."""
+    normalised = sorted(events, key=lambda e: str(e.get('bk_id')))
+    payload = json.dumps(normalised, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _window_key(w) -> str:
+    return f"{w['date_begin']}..{w['date_end']}"
+
+
+def load_fingerprints(state_file: str) -> dict:
+    """Load {window key: fingerprint} from the previous run. Empty when the state itself is missing."""
+    path = _sidecar_path(state_file, 'fingerprints')
+    if not os.path.exists(state_file) or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('windows', {})
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable fingerprints file: {e}")
+        return {}
+
+
+def save_fingerprints(state_file: str, fingerprints: dict) -> None:
+    path = _sidecar_path(state_file, 'fingerprints')
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'windows': fingerprints}, f)
+    except Exception as e:
+        logging.error(f"Error saving fingerprints: {e}")
+
+
+def load_checkpoint(state_file: str) -> dict:
+    """
+    Windows fetched successfully by an unfinished run within TCE_CHECKPOINT_TTL seconds:
+    {plan window key: observed entries (see tce_fetch._fetch_windows)}. Stale windows are dropped.
+    """
+    path = _sidecar_path(state_file, 'checkpoint')
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            windows = json.load(f).get('windows', {})
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable run checkpoint: {e}")
+        return {}
+    cutoff = time.time() - config.TCE_CHECKPOINT_TTL
+    return {key: w['entries'] for key, w in windows.items() if w.get('fetched_at', 0) >= cutoff}
+
+
+def save_checkpoint_window(state_file: str, key: str, entries: list) -> None:
+    """Atomically add one successfully fetched plan window (its observed entries and payload fingerprint)."""
+    path = _sidecar_path(state_file, 'checkpoint')
+    try:
+        windows = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                windows = json.load(f).get('windows', {})
+        windows[key] = {'fetched_at': time.time(),
+                        'fingerprint': _fingerprint_events([e for w in entries for e in w['events']]),
+                        'entries': entries}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'windows': windows}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, path)
+    except Exception as e:
+        logging.error(f"Error saving run checkpoint: {e}")
+
+
+def clear_checkpoint(state_file: str) -> None:
+    path = _sidecar_path(state_file, 'checkpoint')
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _is_complete(windows) -> bool:
+    """True when every planned window was fetched (errors are recorded with count None)."""
+    return all(w['count'] is not None for w in windows)
+
+
+# API fields whose change is reported for an already-notified show
+_TRACKED_FIELDS = ('show_name', 'bk_date', 'hall_name', 'hall_address')
+
+
+def _event_hash(api_event) -> str:
+    """Short content hash over the tracked fields; equal hashes mean nothing to report."""
+    payload = '\x1f'.join(str(api_event.get(f) or '') for f in _TRACKED_FIELDS)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def _index_entry(api_event) -> list:
+    return [_event_hash(api_event)] + [api_event.get(f) or '' for f in _TRACKED_FIELDS]
+
+
+def load_event_index(state_file: str) -> dict:
+    """
+    Load {bk_id (str): [hash, show_name, bk_date, hall_name, hall_address]} for shows seen
+    by previous runs. Empty when the state itself is missing.
+    """
+    path = _sidecar_path(state_file, 'index')
+    if not os.path.exists(state_file) or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('events', {})
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable event index: {e}")
+        return {}
+
+
+def save_event_index(state_file: str, index: dict) -> bool:
+    path = _sidecar_path(state_file, 'index')
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'fields': list(_TRACKED_FIELDS), 'events': index}, f,
+                      ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, path)
+        return True
+    except Exception as e:
+        logging.error(f"Error saving event index: {e}")
+        return False
+
+
+def _describe_changes(old_entry, api_event) -> list:
+    """Human-readable 'old → new' lines (HTML-escaped) for the tracked fields that differ."""
+    old = dict(zip(_TRACKED_FIELDS, old_entry[1:]))
+    lines = []
+    if old['bk_date'] != (api_event.get('bk_date') or ''):
+        lines.append(f"📅 было: {html.escape(_format_bk_date(old['bk_date']), quote=False)}")
+    if (old['hall_name'], old['hall_address']) != (api_event.get('hall_name') or '', api_event.get('hall_address') or ''):
+        was = ', '.join(v for v in (old['hall_name'], old['hall_address']) if v) or '—'
+        now = ', '.join(v for v in (api_event.get('hall_name'), api_event.get('hall_address')) if v) or '—'
+        lines.append(f"📍 {html.escape(was, quote=False)} → {html.escape(now, quote=False)}")
+    if old['show_name'] != (api_event.get('show_name') or ''):
+        lines.append(f"✏️ было: {html.escape(old['show_name'], quote=False)}")
+    return lines
+
+
+def _format_bk_date(bk_date: str) -> str:
+    date_str, time_str = _parse_bk_date(bk_date)
+    return f"{date_str} в {time_str}" if date_str != 'Unknown' else (bk_date or '—')
+
+
+def _classify_events(windows, index, processed_ids, today=None):
+    """
+    One O(n) pass over a theatre's re-fetched windows against the event index.
+    Returns (new, changed, removed):
+      new      raw API events whose bk_id was never processed
+      changed  (api_event, old index entry) for processed shows whose content hash differs
+      removed  (bk_id, old index entry) for indexed future shows inside a re-fetched window's
+               date range that the API no longer returns
+    Only hash mismatches reach the per-field comparison. `index` is updated in place
+    (fetched events upserted, removed and past shows dropped).
+    """
+    today = (today or _date.today()).isoformat()
+    new, changed, fetched = [], [], set()
+    for w in windows:
+        for e in w['events']:
+            key = str(e['bk_id'])
+            fetched.add(key)
+            entry = index.get(key)
+            h = _event_hash(e)
+            if e['bk_id'] not in processed_ids:
+                new.append(e)
+            elif entry is not None and entry[0] != h:
+                changed.append((e, entry))
+            if entry is None or entry[0] != h:
+                index[key] = _index_entry(e)
+
+    ranges = sorted((w['date_begin'], w['date_end']) for w in windows)
+    removed = []
+    for key, entry in list(index.items()):
+        day = str(entry[2])[:10]
+        if day < today:
+            del index[key]  # past show: no longer interesting
+        elif key not in fetched and any(begin <= day <= end for begin, end in ranges):
+            removed.append((key, entry))
+            del index[key]
+    return new, changed, removed
+
+
+def _api_event_from_index(bk_id, entry) -> dict:
+    return {'bk_id': int(bk_id) if bk_id.isdigit() else bk_id, **dict(zip(_TRACKED_FIELDS, entry[1:]))}
 
 
 def _extract_event_list(data) -> list:
@@ -59,325 +318,877 @@ def _extract_event_list(data) -> list:
     return []
 
 
-def _fetch_search_api_with_playwright() -> list:
-    """Navigate to tce.by via Playwright (Anubis bypass), call search API from browser context"""
+def _build_month_windows(today=None, months_ahead=None) -> list:
+    """Build month windows: current month + TCE_MONTHS_AHEAD (or `months_ahead`) future months."""
+    today = today or _date.today()
+    months_ahead = config.TCE_MONTHS_AHEAD if months_ahead is None else months_ahead
+    months = []
+    for offset in range(months_ahead + 1):
+        year = today.year + (today.month - 1 + offset) // 12
+        month = (today.month - 1 + offset) % 12 + 1
+        last_day = calendar.monthrange(year, month)[1]
+        # For the current month start from today to skip already-past events
+        date_begin = today.strftime('%Y-%m-%d') if offset == 0 else f"{year}-{month:02d}-01"
+        months.append({
+            'date_begin': date_begin,
+            'date_end':   f"{year}-{month:02d}-{last_day:02d}",
+        })
+    return months
+
+
+def _window(begin: _date, end: _date) -> dict:
+    return {'date_begin': begin.isoformat(), 'date_end': end.isoformat()}
+
+
+def _window_dates(w):
+    return _date.fromisoformat(w['date_begin']), _date.fromisoformat(w['date_end'])
+
+
+def _split_window(w):
+    """Split a window in half by days. Returns None for single-day windows."""
+    begin, end = _window_dates(w)
+    if begin >= end:
+        return None
+    mid = begin + (end - begin) // 2
+    return [{**w, **_window(begin, mid)}, {**w, **_window(mid + timedelta(days=1), end)}]
+
+
+def load_window_plan(path=None) -> list:
+    """Load the previous run's window plan (list of {date_begin, date_end, count})."""
+    path = path or config.TCE_WINDOW_PLAN_FILE
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f).get('windows', [])
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable window plan: {e}")
+    return []
+
+
+def plan_windows(theatre, today=None) -> list:
+    """
+    Plan the date windows for one theatre's run. Each window carries the theatre's
+    name and server_key so windows of different theatres can share one fetch pool.
+
+    Adaptive mode reuses the previous run's plan clipped to the current horizon
+    (today → end of the TCE_MONTHS_AHEAD-th month), with any newly uncovered tail
+    as its own window; without a plan it starts from one window over the whole
+    horizon and lets cap-splitting refine it. Otherwise calendar months are used.
+    """
+    today = today or _date.today()
+    tag = {'theatre': theatre['name'], 'server_key': theatre['server_key']}
+    months = _build_month_windows(today, theatre['months_ahead'])
+    if not config.TCE_ADAPTIVE_WINDOWS:
+        return [{**m, **tag} for m in months]
+    horizon_end = _date.fromisoformat(months[-1]['date_end'])
+
+    windows = []
+    for w in load_window_plan(theatre['plan_file']):
+        try:
+            begin, end = _window_dates(w)
+        except (KeyError, TypeError, ValueError):
+            continue
+        begin, end = max(begin, today), min(end, horizon_end)
+        if begin > end or (windows and begin <= _date.fromisoformat(windows[-1]['date_end'])):
+            continue
+        windows.append({**_window(begin, end), 'count': w.get('count')})
+
+    if not windows:
+        # No usable plan — start from one large window and let cap-splitting refine it
+        return [{**_window(today, horizon_end), **tag}]
+    windows[0]['date_begin'] = today.isoformat()
+
+    last_end = _date.fromisoformat(windows[-1]['date_end'])
+    if last_end < horizon_end:
+        windows.append(_window(last_end + timedelta(days=1), horizon_end))
+    logging.info(f"[{theatre['name']}] Window plan: {len(windows)} window(s) from previous run")
+    return [{**_window(*_window_dates(w)), **tag} for w in windows]
+
+
+def save_window_plan(observed: list, path=None) -> None:
+    """
+    Persist the windows actually fetched, merging adjacent sparse ones so the next run
+    sends fewer POSTs. Windows whose combined count stays within
+    TCE_WINDOW_FILL_RATIO × TCE_API_RESULT_CAP are merged; errored windows (count None) never are.
+    """
+    if not config.TCE_ADAPTIVE_WINDOWS or not observed:
+        return
+    path = path or config.TCE_WINDOW_PLAN_FILE
+    fill_limit = int(config.TCE_API_RESULT_CAP * config.TCE_WINDOW_FILL_RATIO)
+    merged = []
+    for w in observed:
+        w = {'date_begin': w['date_begin'], 'date_end': w['date_end'], 'count': w['count']}
+        prev = merged[-1] if merged else None
+        if (prev is not None and prev['count'] is not None and w['count'] is not None
+                and prev['count'] + w['count'] <= fill_limit):
+            prev['date_end'] = w['date_end']
+            prev['count'] += w['count']
+        else:
+            merged.append(w)
     try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(
-                headless=config.USE_HEADLESS,
-                args=[
-                    '--disable-blink-features=AutomationControlled',
-                    '--disable-infobars',
-                    '--no-first-run',
-                    '--no-default-browser-check',
-                ]
-            )
-            context = browser.new_context(
-                user_agent=config.USER_AGENT,
-                viewport={'width': 1920, 'height': 1080},
-                locale='ru-RU',
-                color_scheme='light',
-                has_touch=False,
-                is_mobile=False,
-                extra_http_headers={
-                    "Accept-Language": config.ACCEPT_LANGUAGE,
-                    "DNT": "1",
-                    "Upgrade-Insecure-Requests": "1",
-                }
-            )
-            page = context.new_page()
-
-            # Patch automation detection before any page script runs
-            page.add_init_script("""
-                Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-                Object.defineProperty(navigator, 'plugins', {get: () => [1, 2, 3, 4, 5]});
-                Object.defineProperty(navigator, 'languages', {get: () => ['ru-RU', 'ru', 'en-US', 'en']});
-                window.chrome = {runtime: {}};
-            """)
-
-            # Land on homepage first — natural entry point, establishes session
-            logging.info("Navigating to tce.by homepage...")
-            page.goto("https://tce.by/", wait_until='networkidle',
-                      timeout=config.BROWSER_TIMEOUT * 1000)
-            time.sleep(random.uniform(2, 4))
-
-            # Navigate to search page — triggers Anubis clearance
-            logging.info("Navigating to tce.by/search.html...")
-            page.goto("https://tce.by/search.html", wait_until='networkidle',
-                      timeout=config.BROWSER_TIMEOUT * 1000)
-            time.sleep(random.uniform(4, 8))  # Anubis JS challenge + page settling
-
-            # Simulate natural user interaction
-            page.evaluate(f"window.scrollBy(0, {random.randint(150, 400)})")
-            time.sleep(random.uniform(0.5, 1.5))
-            page.mouse.move(random.randint(200, 1200), random.randint(150, 700))
-
-            # Build month windows: current month + TCE_MONTHS_AHEAD future months
-            today = _date.today()
-            months = []
-            for offset in range(config.TCE_MONTHS_AHEAD + 1):
-                year = today.year + (today.month - 1 + offset) // 12
-                month = (today.month - 1 + offset) % 12 + 1
-                last_day = calendar.monthrange(year, month)[1]
-                # For the current month start from today to skip already-past events
-                date_begin = today.strftime('%Y-%m-%d') if offset == 0 else f"{year}-{month:02d}-01"
-                months.append({
-                    'date_begin': date_begin,
-                    'date_end':   f"{year}-{month:02d}-{last_day:02d}",
-                })
-
-            # One POST per month — reuses the same Anubis-cleared session
-            _JS_FETCH = """
-                async (args) => {
-                    try {
-                        const body = new URLSearchParams({
-                            bk_id: '', date_begin: args.date_begin, date_end: args.date_end,
-                            tags: '', server_key: args.server_key,
-                            loc_id: '0', hall_id: '0', order_id: '0', type: ''
-                        }).toString();
-                        const r = await fetch('/index.php?view=shows&action=find&kind=text', {
-                            method: 'POST',
-                            headers: {
-                                'Content-Type': 'application/x-www-form-urlencoded',
-                                'Accept': 'application/json, text/javascript, */*; q=0.01',
-                                'X-Requested-With': 'XMLHttpRequest'
-                            },
-                            body: body
-                        });
-                        if (!r.ok) return {_error: r.status};
-                        return await r.json();
-                    } catch(e) { return {_error: e.toString()}; }
-                }
-            """
-
-            all_events = []
-            seen_ids = set()
-            for m in months:
-                logging.info(f"Fetching puppet events {m['date_begin']} → {m['date_end']}")
-                chunk = page.evaluate(_JS_FETCH, {**m, 'server_key': config.TCE_BASE_PARAM})
-                if isinstance(chunk, dict) and '_error' in chunk:
-                    logging.error(f"API error for {m['date_begin']}: {chunk}")
-                    continue
-                events = _extract_event_list(chunk)
-                logging.info(f"  {m['date_begin'][:7]}: {len(events)} events")
-                for e in events:
-                    if e.get('bk_id') not in seen_ids:
-                        seen_ids.add(e['bk_id'])
-                        all_events.append(e)
-                if len(events) == 0:
-                    logging.info("  No events this month — stopping early")
-                    break
-                time.sleep(random.uniform(1.5, 4.0))  # think-time between API calls
-
-            browser.close()
-
-            logging.info(f"Total unique puppet events across all months: {len(all_events)}")
-            return all_events
-
-    except PlaywrightTimeout as e:
-        logging.error(f"Playwright timeout fetching search API: {e}")
-        raise
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'windows': merged}, f, indent=2)
+        logging.info(f"Saved window plan: {len(observed)} fetched → {len(merged)} planned window(s)")
     except Exception as e:
-        logging.error(f"Error fetching search API with Playwright: {e}")
-        raise
+        logging.error(f"Error saving window plan: {e}")
+
+
+def _window_events(windows) -> list:
+    return [e for w in windows for e in w['events']]
+
+
+def fetch_theatre_events(theatres, session=None, on_window=None) -> dict:
+    """
+    Fetch events for every theatre from the tce.by search API through one cleared session.
+    Each theatre is filtered server-side by its server_key.
+    Returns {theatre name: fetched windows}; each window carries its deduplicated raw
+    API events under 'events' and a content fingerprint. `on_window(theatre, window,
+    entries)` sees each window as soon as it is fetched (see _NotifyStream).
+    """
+    from tce_fetch import _fetch_search_api_with_playwright
+    windows_by_theatre = _fetch_search_api_with_playwright(theatres, session=session, on_window=on_window)
+    for name, windows in windows_by_theatre.items():
+        logging.info(f"Search API: {len(_window_events(windows))} {name} events (server-filtered by server_key)")
+    return windows_by_theatre
 
 
-def fetch_puppet_events_from_api() -> list:
+def fetch_puppet_events_from_api(session=None) -> list:
     """
     Fetch puppet theatre events from the tce.by search API.
-    Filters by server_key == TCE_BASE_PARAM.
+    Uses the 'puppet' theatre's server_key (TCE_BASE_PARAM when there is no theatres file).
     Returns list of raw API event dicts (each has bk_id, show_name, bk_date, etc.).
+    Raises ValueError when TCE_THEATRES_FILE has no theatre named 'puppet'.
     """
-    raw = _fetch_search_api_with_playwright()
+    theatre = next((t for t in load_theatres() if t['name'] == 'puppet'), None)
+    if theatre is None:
+        raise ValueError(f"No theatre named 'puppet' in {config.TCE_THEATRES_FILE}")
+    return _window_events(fetch_theatre_events([theatre], session=session)[theatre['name']])
 
-    logging.info(f"Search API: {len(raw)} puppet theatre events (server-filtered by server_key)")
-    return raw
 
+class EventRecord:
+    """Compact normalised event. to_dict() gives the dict shape stored and notified."""
+    __slots__ = ('id', 'theatre', 'url', 'title', 'date', 'time', 'venue', 'description', 'image', 'found_at')
+
+    def __init__(self, id, theatre, url, title, date, time, venue, description, image, found_at):
+        self.id = id
+        self.theatre = theatre
+        self.url = url
+        self.title = title
+        self.date = date
+        self.time = time
+        self.venue = venue
+        self.description = description
+        self.image = image
+        self.found_at = found_at
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
 
-def _build_event_from_api(api_event: dict) -> dict:
-    """Build a normalised event dict from a search API response item."""
-    event_id = api_event['bk_id']
-    url = f"{config.TCE_BASE_URL}?base={config.TCE_BASE_PARAM}&data={event_id}"
 
-    date_str, time_str = 'Unknown', 'Unknown'
-    bk_date = api_event.get('bk_date', '')
+@lru_cache(maxsize=4096)
+def _parse_bk_date(bk_date):
+    """'YYYY-MM-DD HH:MM:SS' → ('dd.mm.yyyy', 'HH:MM'); shows share few distinct dates, so memoised."""
     try:
-        from datetime import datetime as _dt
-        d = _dt.strptime(bk_date, '%Y-%m-%d %H:%M:%S')
-        date_str = d.strftime('%d.%m.%Y')
-        time_str = d.strftime('%H:%M')
+        d = datetime.strptime(bk_date, '%Y-%m-%d %H:%M:%S')
     except (ValueError, TypeError):
-        pass
-
-    venue = api_event.get('hall_name', 'Unknown')
-    address = api_event.get('hall_address', '')
-    if address:
-        venue = f"{venue}, {address}"
-
-    return {
-        'id': event_id,
-        'url': url,
-        'title': api_event.get('show_name', 'Unknown'),
-        'date': date_str,
-        'time': time_str,
-        'venue': venue,
-        'description': api_event.get('owner_name', ''),
-        'image': '',
-        'found_at': datetime.now().isoformat(),
-    }
-
-
-def send_channel_post(message, disable_notification=True, use_test_channel=False):
-    """Send a message to the configured Telegram channel."""
+        return 'Unknown', 'Unknown'
+    return d.strftime('%d.%m.%Y'), d.strftime('%H:%M')
+
+
+# Search API item fields that may carry a poster (the API has not been seen to send one yet)
+_API_IMAGE_FIELDS = ('show_image', 'image', 'poster', 'img')
+
+
+def _api_image(api_event) -> str:
+    for field in _API_IMAGE_FIELDS:
+        value = api_event.get(field)
+        if value:
+            return value if '://' in value else f"{config.TCE_ORIGIN}/{value.lstrip('/')}"
+    return ''
+
+
+def _normalise_event(api_event, theatre_name, url_prefix, found_at, venues) -> EventRecord:
+    event_id = api_event['bk_id']
+    date_str, time_str = _parse_bk_date(api_event.get('bk_date', ''))
+    hall = (api_event.get('hall_name', 'Unknown'), api_event.get('hall_address', ''))
+    venue = venues.get(hall)
+    if venue is None:
+        venue = venues[hall] = f"{hall[0]}, {hall[1]}" if hall[1] else hall[0]
+    return EventRecord(
+        event_id, theatre_name, f"{url_prefix}{event_id}", api_event.get('show_name', 'Unknown'),
+        date_str, time_str, venue, api_event.get('owner_name', ''), _api_image(api_event), found_at,
+    )
+
+
+def normalise_events(api_events, theatre=None):
+    """
+    Normalise a fetched batch of search API items, yielding EventRecords as they are built.
+    Date parsing and venue strings are memoised and found_at is taken once per batch.
+    Items that cannot be normalised are logged and skipped.
+    """
+    server_key = theatre['server_key'] if theatre else config.TCE_BASE_PARAM
+    theatre_name = theatre['name'] if theatre else 'puppet'
+    url_prefix = f"{config.TCE_BASE_URL}?base={server_key}&data="
+    found_at = datetime.now().isoformat()
+    venues = {}
+    for api_event in api_events:
+        try:
+            yield _normalise_event(api_event, theatre_name, url_prefix, found_at, venues)
+        except Exception as e:
+            logging.error(f"Error processing event bk_id={api_event.get('bk_id')}: {e}")
+
+
+def _build_event_from_api(api_event: dict, theatre=None) -> dict:
+    """Build a normalised event dict from a single search API response item."""
+    server_key = theatre['server_key'] if theatre else config.TCE_BASE_PARAM
+    return _normalise_event(
+        api_event, theatre['name'] if theatre else 'puppet', f"{config.TCE_BASE_URL}?base={server_key}&data=",
+        datetime.now().isoformat(), {},
+    ).to_dict()
+
+
+def send_channel_post(message, disable_notification=True, use_test_channel=False, chat_id=None):
+    """Send a message to the configured Telegram channel (or an explicit `chat_id`)."""
     bot_token = config.TELEGRAM_BOT_TOKEN
-    channel_id = config.TEST_TELEGRAM_CHAT_ID if use_test_channel else config.TELEGRAM_CHAT_ID
+    channel_id = chat_id or (config.TEST_TELEGRAM_CHAT_ID if use_test_channel else config.TELEGRAM_CHAT_ID)
     channel_type = "test" if use_test_channel else "production"
 
     if not bot_token or not channel_id:
         logging.error(f"Telegram bot token or {channel_type} channel ID not configured")
         return False
 
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    try:
-        response = requests.post(url, json={
-            'chat_id': channel_id,
-            'text': message,
-            'parse_mode': 'HTML',
-            'disable_web_page_preview': False,
-            'disable_notification': disable_notification,
-        }, timeout=10)
-
-        if not response.ok:
-            error = response.json()
-            logging.error(f"Telegram API error: {error.get('description', response.text)}")
-        response.raise_for_status()
-        logging.info(f"Notification sent to {channel_type} channel ({channel_id})")
-        return True
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Failed to send to {channel_type} channel: {e}")
+    from telegram_client import get_telegram_client
+    record = get_telegram_client().send_message(
+        channel_id, message,
+        parse_mode='HTML',
+        disable_web_page_preview=False,
+        disable_notification=disable_notification,
+    )
+    metrics.observe('telegram_send', record['latency'], ok=record['ok'], chat_id=str(channel_id),
+                    status=record['status'], retries=record['retries'])
+    metrics.incr('telegram_retries', record['retries'])
+    if not record['ok']:
+        logging.error(f"Failed to send to {channel_type} channel: {record['description']} "
+                      f"(status {record['status']}, {record['retries']} retries)")
         return False
+    logging.info(f"Notification sent to {channel_type} channel ({channel_id}) in {record['latency']:.2f}s, "
+                 f"{record['retries']} retries")
+    return True
 
 
-def _format_event_line(event) -> str:
-    """Format a single event as a compact line: title, date/time, link."""
-    line = f"<b>{event['title']}</b>"
+def _format_event_line(event, max_title=None, link=True) -> str:
+    """Format a single event as a compact line: title, date/time, link. Fields are HTML-escaped."""
+    title = event['title']
+    if max_title is not None and len(title) > max_title:
+        title = title[:max(max_title - 1, 0)] + '…'
+    line = f"<b>{html.escape(title, quote=False)}</b>"
     if event.get('date') and event['date'] != 'Unknown':
-        dt = f"📅 {event['date']}"
+        dt = f"📅 {html.escape(event['date'], quote=False)}"
         if event.get('time') and event['time'] != 'Unknown':
-            dt += f" в {event['time']}"
+            dt += f" в {html.escape(event['time'], quote=False)}"
         line += f"\n{dt}"
     elif event.get('time') and event['time'] != 'Unknown':
-        line += f"\n🕒 {event['time']}"
-    line += f"\n🎟 <a href='{event['url']}'>Билеты</a>"
+        line += f"\n🕒 {html.escape(event['time'], quote=False)}"
+    if link:
+        line += f"\n🎟 <a href='{html.escape(event['url'])}'>Билеты</a>"
     return line
 
 
-def notify_tce_events(events, use_test_channel=False):
-    """Send new TCE events to Telegram, batching 10 events per message."""
-    BATCH_SIZE = 10
-    prefix = "🧪 [TEST] " if use_test_channel else ""
-    channel_username = config.TEST_TELEGRAM_CHANNEL_USERNAME if use_test_channel else config.TELEGRAM_CHANNEL_USERNAME
-    total = len(events)
-    batches = [events[i:i + BATCH_SIZE] for i in range(0, total, BATCH_SIZE)]
-    all_ok = True
+def _format_change_line(event, max_title=None) -> str:
+    """An updated event (new date/time/hall) followed by its 'old → new' lines from event['changes']."""
+    line = _format_event_line(event, max_title, link=False) + ''.join(f"\n{c}" for c in event['changes'])
+    return line + f"\n🎟 <a href='{html.escape(event['url'])}'>Билеты</a>"
+
+
+def _format_removed_line(event, max_title=None) -> str:
+    """A show that disappeared from the schedule: title and its last known date, no ticket link."""
+    return _format_event_line(event, max_title, link=False)
+
+
+_BLOCK_FORMATTERS = {'new': _format_event_line, 'changed': _format_change_line, 'removed': _format_removed_line}
+
+
+_TAG_RE = re.compile(r'<[^>]+>')
+
+
+def _telegram_length(message: str) -> int:
+    """
+    Length of an HTML message as Telegram counts it against the 4096 limit:
+    after tags are stripped and entities decoded, in UTF-16 code units.
+    """
+    text = html.unescape(_TAG_RE.sub('', message))
+    return len(text.encode('utf-16-le')) // 2
+
+
+_HEADERS = {
+    # kind: (single event, several events)
+    'new': ("🎭 <b>НОВЫЙ СПЕКТАКЛЬ!</b>", "🎭 <b>НОВЫЕ СПЕКТАКЛИ! ({})</b>"),
+    'changed': ("🔄 <b>ИЗМЕНЕНИЕ В РАСПИСАНИИ</b>", "🔄 <b>ИЗМЕНЕНИЯ В РАСПИСАНИИ ({})</b>"),
+    'removed': ("🚫 <b>СПЕКТАКЛЬ СНЯТ С РАСПИСАНИЯ</b>", "🚫 <b>СНЯТЫ С РАСПИСАНИЯ ({})</b>"),
+}
+
 
+def _message_header(prefix, count, batch_num, batch_total, kind='new') -> str:
+    single, several = _HEADERS[kind]
+    if batch_total == 1:
+        return f"{prefix}{single}" if count == 1 else f"{prefix}{several.format(count)}"
+    return f"{prefix}{several.format(f'{batch_num}/{batch_total}')}"
+
+
+def _message_footer(channel_username) -> str:
+    return f"➖➖➖➖➖➖➖➖➖➖➖➖\nПодпишись {html.escape(str(channel_username), quote=False)} для получения уведомлений!"
+
+
+def _fit_block(event, format_block, budget):
+    """
+    (block, size) for an event whose block is longer than `budget`, its title shortened until
+    the block fits. Telegram counts UTF-16 units while titles are cut in code points, so each
+    pass drops enough trailing code points to cover the overflow and re-measures.
+    """
+    title = event['title']
+    keep = len(title)
+    block = format_block(event)
+    size = _telegram_length(block)
+    while size > budget and keep > 1:
+        drop, units = 0, 0
+        while units < size - budget and drop < keep - 1:
+            units += 2 if ord(title[keep - 1 - drop]) > 0xFFFF else 1
+            drop += 1
+        keep -= drop
+        block = format_block(event, max_title=keep)
+        size = _telegram_length(block)
+    return block, size
+
+
+def _pack_event_messages(events, prefix, channel_username, kind='new') -> list:
+    """
+    Pack event blocks into as few messages as possible without exceeding
+    TELEGRAM_MESSAGE_LIMIT. Returns [(batch_events, message_html)].
+
+    Blocks are sized against the longest header this run could need, so the real
+    headers (which depend on the final message count) always fit.
+    """
+    limit = config.TELEGRAM_MESSAGE_LIMIT
+    separator = 2  # "\n\n" between header, blocks and footer
+    worst_header = max(
+        _telegram_length(_message_header(prefix, len(events), 1, 1, kind)),
+        _telegram_length(_message_header(prefix, len(events), len(events), len(events), kind)),
+    )
+    fixed = worst_header + separator + separator + _telegram_length(_message_footer(channel_username))
+    budget = limit - fixed
+    format_block = _BLOCK_FORMATTERS[kind]
+
+    batches, current, used = [], [], 0
+    for event in events:
+        block = format_block(event)
+        size = _telegram_length(block)
+        if size > budget:
+            # A single oversized block (absurdly long title): shorten the title to fit
+            block, size = _fit_block(event, format_block, budget)
+        needed = size + (separator if current else 0)
+        if current and used + needed > budget:
+            batches.append(current)
+            current, used = [], 0
+            needed = size
+        current.append((event, block))
+        used += needed
+    if current:
+        batches.append(current)
+
+    footer = _message_footer(channel_username)
+    packed = []
     for batch_num, batch in enumerate(batches, 1):
-        try:
-            count = len(batch)
-            if total <= BATCH_SIZE:
-                header = f"{prefix}🎭 <b>НОВЫЙ СПЕКТАКЛЬ!</b>" if count == 1 else f"{prefix}🎭 <b>НОВЫЕ СПЕКТАКЛИ! ({count})</b>"
-            else:
-                header = f"{prefix}🎭 <b>НОВЫЕ СПЕКТАКЛИ! ({batch_num}/{len(batches)})</b>"
+        header = _message_header(prefix, len(batch), batch_num, len(batches), kind)
+        blocks = "\n\n".join(block for _, block in batch)
+        packed.append(([e for e, _ in batch], f"{header}\n\n{blocks}\n\n{footer}"))
+    return packed
 
-            blocks = "\n\n".join(_format_event_line(e) for e in batch)
-            message = f"{header}\n\n{blocks}\n\n➖➖➖➖➖➖➖➖➖➖➖➖\nПодпишись {channel_username} для получения уведомлений!"
 
-            success = send_channel_post(message, disable_notification=False, use_test_channel=use_test_channel)
+def _log_titles(events) -> None:
+    """DEBUG-log the titles of a sent batch; the join is skipped unless DEBUG is enabled."""
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("  Titles: %s", ', '.join(e['title'] for e in events))
+
+
+def _channel(use_test_channel=False, theatre=None):
+    """(message prefix, chat_id, channel username) for the theatre's (or the default) channel."""
+    prefix = "🧪 [TEST] " if use_test_channel else ""
+    if theatre:
+        chat_id = theatre['test_chat_id'] if use_test_channel else theatre['chat_id']
+        channel_username = theatre['test_channel_username'] if use_test_channel else theatre['channel_username']
+    else:
+        chat_id = None
+        channel_username = config.TEST_TELEGRAM_CHANNEL_USERNAME if use_test_channel else config.TELEGRAM_CHANNEL_USERNAME
+    return prefix, chat_id, channel_username
+
+
+def notify_tce_events(events, use_test_channel=False, theatre=None, kind='new'):
+    """
+    Send TCE events to Telegram (to the theatre's channel if given), packing as many
+    events into each message as the Telegram length limit allows.
+    `kind` is 'new', 'changed' (events carry 'changes' lines) or 'removed'.
+    """
+    prefix, chat_id, channel_username = _channel(use_test_channel, theatre)
+    messages = _pack_event_messages(events, prefix, channel_username, kind)
+    all_ok = True
+    started = time.monotonic()  # pacing is left to the client's rate limiter
+
+    for batch_num, (batch, message) in enumerate(messages, 1):
+        try:
+            success = send_channel_post(message, disable_notification=False, use_test_channel=use_test_channel,
+                                        chat_id=chat_id)
             if success:
-                logging.info(f"✅ Notification sent (batch {batch_num}/{len(batches)}): {', '.join(e['title'] for e in batch)}")
+                logging.info(f"✅ Notification sent (batch {batch_num}/{len(messages)}): {len(batch)} event(s)")
+                _log_titles(batch)
             else:
-                logging.error(f"❌ Failed to send notification batch {batch_num}/{len(batches)}")
+                logging.error(f"❌ Failed to send notification batch {batch_num}/{len(messages)}")
+                metrics.incr('failed_batches')
                 all_ok = False
-            if batch_num < len(batches):
-                time.sleep(2)
         except Exception as e:
             logging.error(f"Error sending TCE notification batch {batch_num}: {e}")
+            metrics.incr('failed_batches')
             all_ok = False
 
+    from telegram_client import get_telegram_client
+    stats = get_telegram_client().summary(since=started)
+    logging.info(f"Telegram delivery: {len(events)} events in {len(messages)} message(s); "
+                 f"{stats['sent']} sent, {stats['failed']} failed, {stats['retries']} retries, "
+                 f"max latency {stats['max_latency']:.2f}s")
     return all_ok
 
 
-def check_for_new_tce_events(use_test_channel=False, notify=True) -> list:
+def _outbox_items(events, kind, use_test_channel=False, theatre=None, versions=None) -> list:
     """
-    Main entry point. Fetches puppet theatre events from the tce.by search API,
-    processes only IDs not yet seen, sends immediate notifications, and persists
-    the updated processed-ID set.
+    Outbox items for one notification kind. The idempotency key is channel + kind + event id
+    (+ content hash for changes/removals, from `versions` keyed by str id), so re-queuing the same
+    announcement after a crash is a no-op while a second change of a show is not.
+    """
+    prefix, chat_id, channel_username = _channel(use_test_channel, theatre)
+    if chat_id is None:
+        chat_id = config.TEST_TELEGRAM_CHAT_ID if use_test_channel else config.TELEGRAM_CHAT_ID
+    items = []
+    for event in events:
+        key = f"{kind}:{chat_id}:{event['id']}"
+        if versions:
+            key += f":{versions[str(event['id'])]}"
+        items.append({'key': key, 'chat_id': chat_id, 'kind': kind, 'theatre': theatre['name'] if theatre else None,
+                      'prefix': prefix, 'channel': channel_username, 'event': event})
+    return items
 
-    Returns list of newly found event dicts.
+
+def drain_outbox(store=None, limit=None) -> dict:
     """
-    logging.info("=" * 60)
-    logging.info("Starting TCE.BY puppet theatre monitoring (search-API mode)")
-    logging.info("=" * 60)
+    Deliver the due outbox items: group them by channel and kind, pack each group into as
+    few messages as possible and send them. A failed message's items are retried later with
+    exponential backoff, and given up ('dead') after TCE_OUTBOX_MAX_ATTEMPTS.
 
-    # Step 1: get puppet theatre events from search API (single browser session)
-    api_events = fetch_puppet_events_from_api()
-    if not api_events:
-        logging.info("No puppet theatre events returned by search API")
-        return []
+    Pass a `store` when draining from another thread (SQLite connections are per thread).
+    Drains in one process never overlap, so no item is picked up by two of them.
+    Returns item counts: sent, failed, dead, still pending, and messages sent.
+    """
+    with _drain_lock:
+        return _drain_outbox(store or _event_store(), limit)
 
-    fetched_ids = {e['bk_id'] for e in api_events}
 
-    # Step 2: find which are new
-    processed_ids = load_processed_ids()
-    new_api_events = [e for e in api_events if e['bk_id'] not in processed_ids]
-    logging.info(f"API events: {len(api_events)}, already processed: {len(processed_ids)}, new: {len(new_api_events)}")
+_drain_lock = threading.Lock()
 
-    if not new_api_events:
-        logging.info("No new puppet theatre events")
-        save_processed_ids(processed_ids | fetched_ids)
-        return []
 
-    # Step 3: build events
-    new_events = []
-    for api_event in new_api_events:
+def _drain_outbox(store, limit=None) -> dict:
+    items = store.outbox_due(limit=limit)
+    totals = {'sent': 0, 'failed': 0, 'dead': 0, 'messages': 0}
+    if items:
+        started = time.monotonic()
+        groups = {}
+        for item in items:
+            groups.setdefault((item['chat_id'], item['kind'], item['prefix'], item['channel']), []).append(item)
+        for (chat_id, kind, prefix, channel_username), group in groups.items():
+            keys = {id(item['event']): item['key'] for item in group}
+            attempts = max(item['attempts'] for item in group) + 1
+            messages = _pack_event_messages([item['event'] for item in group], prefix, channel_username, kind)
+            for batch_num, (batch, message) in enumerate(messages, 1):
+                batch_keys = [keys[id(e)] for e in batch]
+                try:
+                    ok = send_channel_post(message, disable_notification=False, use_test_channel=bool(prefix),
+                                           chat_id=chat_id)
+                except Exception as e:
+                    logging.error(f"Error sending TCE notification batch {batch_num}: {e}")
+                    ok = False
+                if ok:
+                    store.outbox_mark_sent(batch_keys)
+                    totals['sent'] += len(batch)
+                    totals['messages'] += 1
+                    logging.info(f"✅ Notification sent ({kind}, batch {batch_num}/{len(messages)}): "
+                                 f"{len(batch)} event(s)")
+                    _log_titles(batch)
+                    if config.TCE_POSTERS and kind == 'new':
+                        try:  # best-effort: the text alert is already delivered
+                            _send_posters(chat_id, batch)
+                        except Exception as e:
+                            logging.warning(f"Poster delivery failed: {e}")
+                    continue
+                delay = min(config.TCE_OUTBOX_RETRY_BASE * 2 ** (attempts - 1), config.TCE_OUTBOX_RETRY_MAX)
+                dead = store.outbox_mark_failed(batch_keys, 'send failed', time.time() + delay,
+                                                config.TCE_OUTBOX_MAX_ATTEMPTS)
+                metrics.incr('failed_batches')
+                totals['failed'] += len(batch)
+                totals['dead'] += dead
+                if dead:
+                    logging.error(f"❌ Giving up on {dead} {kind} notification(s) for {chat_id} after "
+                                  f"{config.TCE_OUTBOX_MAX_ATTEMPTS} attempts")
+                else:
+                    logging.error(f"❌ Failed to send {kind} batch {batch_num}/{len(messages)} "
+                                  f"(attempt {attempts}); retrying in {delay:.0f}s")
+
+        from telegram_client import get_telegram_client
+        stats = get_telegram_client().summary(since=started)
+        logging.info(f"Telegram delivery: {len(items)} queued events in {totals['messages']} message(s); "
+                     f"{stats['sent']} sent, {stats['failed']} failed, {stats['retries']} retries, "
+                     f"max latency {stats['max_latency']:.2f}s")
+    store.outbox_prune(config.TCE_OUTBOX_RETENTION_DAYS)
+    totals['pending'] = store.outbox_counts().get('pending', 0)
+    metrics.incr('outbox_sent', totals['sent'])
+    metrics.incr('outbox_failed', totals['failed'])
+    metrics.incr('outbox_dead', totals['dead'])
+    if items or totals['pending']:
+        logging.info(f"Outbox: {totals['sent']} delivered, {totals['failed']} failed, "
+                     f"{totals['pending']} pending")
+    return totals
+
+
+class _NotifyStream:
+    """
+    Delivery stage that overlaps the fetch. The fetch (main thread, which owns Playwright)
+    hands each completed window to put(); a worker thread stores the window's not yet
+    processed events, queues their 'new' notifications and drains the outbox, so the
+    first month's alerts go out while later months are still being fetched.
+
+    The per-theatre pass after the fetch queues the same events again under the same
+    idempotency keys, which is a no-op; changes and removals still wait for it, since
+    they need complete coverage. The queue is bounded (TCE_STREAM_QUEUE_SIZE windows):
+    when delivery falls behind, the fetch waits.
+    """
+
+    def __init__(self, theatres, use_test_channel=False):
+        self.use_test_channel = use_test_channel
+        self.processed = {t['name']: load_processed_ids(t['state_file']) for t in theatres}
+        self.streamed = 0
+        self._started = time.perf_counter()
+        self._first_alert = False
+        self._queue = queue.Queue(maxsize=config.TCE_STREAM_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name='notify-stream', daemon=True)
+        self._thread.start()
+
+    def put(self, theatre, window, entries) -> None:
+        self._queue.put((theatre, entries))
+
+    def close(self) -> None:
+        """Let the worker finish the queued windows (and their sends), then stop it."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        store = None
         try:
-            event = _build_event_from_api(api_event)
-            logging.info(f"  New event: {event['title']} on {event['date']} at {event['time']}")
-            save_single_tce_event(event)
-            new_events.append(event)
-            processed_ids.add(api_event['bk_id'])
+            from event_store import EventStore
+            store = EventStore()  # SQLite connections are per thread
         except Exception as e:
-            logging.error(f"Error processing event bk_id={api_event.get('bk_id')}: {e}")
-            processed_ids.add(api_event.get('bk_id'))
+            logging.error(f"Notification stream disabled, event store unavailable: {e}")
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if store is None:
+                continue  # keep consuming so the fetch never blocks on a dead stage
+            try:
+                self._deliver(store, *item)
+            except Exception as e:
+                logging.error(f"Notification stream: {e}")
+        if store is not None:
+            store.close()
+
+    def _deliver(self, store, theatre, entries) -> None:
+        processed = self.processed[theatre['name']]
+        fresh = {}
+        for w in entries:
+            for e in w['events']:
+                if e['bk_id'] not in processed:
+                    fresh.setdefault(e['bk_id'], e)
+        if not fresh:
+            return
+        processed.update(fresh)  # later windows repeating these IDs are not streamed twice
+        events = [record.to_dict() for record in normalise_events(list(fresh.values()), theatre)]
+        stored = store.add_many(events, _outbox_items(events, 'new', self.use_test_channel, theatre))
+        self.streamed += len(events)
+        logging.info(f"[{theatre['name']}] Streaming {len(events)} new event(s) ahead of the full diff "
+                     f"({stored} not stored before)")
+        if drain_outbox(store=store)['sent'] and not self._first_alert:
+            self._first_alert = True
+            metrics.observe('first_alert', time.perf_counter() - self._started)
 
-    # Step 4: send one combined notification for all new events
-    if notify and new_events:
-        notify_tce_events(new_events, use_test_channel=use_test_channel)
-    elif new_events:
+
+_MEDIA_GROUP_LIMIT = 10  # photos per sendMediaGroup
+
+
+def _send_posters(chat_id, events) -> int:
+    """
+    Send the distinct posters of a delivered batch as albums (a single poster as a photo),
+    captioned with the show titles. Posters are cached by content, so a show that repeats
+    across dates is downloaded and uploaded once; later sends reuse the cached file_id.
+    Returns how many posters were sent.
+    """
+    import mimetypes
+    from posters import get_poster_cache
+    from telegram_client import get_telegram_client
+    cache = get_poster_cache()
+    wanted = {}  # poster URL → title
+    for e in events:
+        url = e.get('image') or cache.poster_url(e['title'])
+        if url:
+            wanted.setdefault(url, e['title'])
+    if not wanted:
+        return 0
+    with metrics.phase('poster_download', posters=len(wanted)):
+        downloaded = cache.get(wanted)
+    posters = {}  # sha256 → (path, title): different URLs of the same image collapse here
+    for url, (sha, path) in downloaded.items():
+        posters.setdefault(sha, (path, wanted[url]))
+    posters = list(posters.items())
+
+    client = get_telegram_client()
+    sent = 0
+    for start in range(0, len(posters), _MEDIA_GROUP_LIMIT):
+        chunk = posters[start:start + _MEDIA_GROUP_LIMIT]
+        media, uploads = [], {}
+        for i, (sha, (path, title)) in enumerate(chunk):
+            file_id = cache.file_id(sha)
+            if not file_id:
+                with open(path, 'rb') as f:
+                    uploads[f"poster{i}"] = (os.path.basename(path), f.read(),
+                                             mimetypes.guess_type(path)[0] or 'image/jpeg')
+                file_id = f"attach://poster{i}"
+            media.append({'type': 'photo', 'media': file_id, 'parse_mode': 'HTML',
+                          'caption': f"<b>{html.escape(title[:1000], quote=False)}</b>"})
+        if len(media) == 1:
+            # sendPhoto takes a new upload as the 'photo' form field itself
+            photo, files = (None, {'photo': uploads.popitem()[1]}) if uploads else (media[0]['media'], None)
+            record = client.send_photo(chat_id, photo, files=files, caption=media[0]['caption'],
+                                       parse_mode='HTML', disable_notification=True)
+            messages = [record['result']] if record['ok'] else []
+        else:
+            record = client.send_media_group(chat_id, media, files=uploads or None, disable_notification=True)
+            messages = record['result'] if record['ok'] else []
+        metrics.observe('telegram_send', record['latency'], ok=record['ok'], chat_id=str(chat_id),
+                        status=record['status'], retries=record['retries'], method=record['method'])
+        if not record['ok']:
+            logging.warning(f"Poster send to {chat_id} failed: {record['description']}")
+            continue
+        for (sha, _), message in zip(chunk, messages):
+            photo = (message or {}).get('photo') or []
+            if photo:
+                cache.set_file_id(sha, photo[-1]['file_id'])
+        sent += len(chunk)
+        metrics.incr('posters_uploaded', len(uploads))
+    cache.save()
+    metrics.incr('posters_sent', sent)
+    logging.info(f"Sent {sent} poster(s) to {chat_id} ({len(wanted)} referenced)")
+    return sent
+
+
+def _process_theatre_events(theatre, windows, use_test_channel=False, notify=True) -> list:
+    """
+    Diff one theatre's fetched windows against its state, store the new events and queue their notifications.
+    Windows whose response fingerprint matches the previous run are short-circuited: if
+    none changed, the diff, build and persist phases are skipped entirely.
+    """
+    name = theatre['name']
+    fetched_windows = [w for w in windows if w['fingerprint'] is not None]
+    previous = load_fingerprints(theatre['state_file'])
+    changed = [w for w in fetched_windows if previous.get(_window_key(w)) != w['fingerprint']]
+    logging.info(f"[{name}] {len(fetched_windows) - len(changed)}/{len(fetched_windows)} window(s) "
+                 f"unchanged since last run (short-circuited)")
+    metrics.incr('windows_short_circuited', len(fetched_windows) - len(changed))
+    if not changed:
+        logging.info(f"[{name}] No window changed — skipping diff and persist")
+        return []
+    current = {_window_key(w): w['fingerprint'] for w in fetched_windows}
+
+    api_events = _window_events(changed)
+    fetched_ids = {e['bk_id'] for e in api_events}
+    state_file = theatre['state_file']
+
+    # Classify against the processed IDs and the per-event content-hash index
+    with metrics.phase('diff', theatre=name) as record:
+        processed_ids = load_processed_ids(state_file)
+        index = load_event_index(state_file)
+        new_api_events, changed_events, removed_events = _classify_events(changed, index, processed_ids)
+        record['events'] = len(api_events)
+    logging.info(f"[{name}] API events: {len(api_events)}, already processed: {len(processed_ids)}, "
+                 f"new: {len(new_api_events)}, changed: {len(changed_events)}, removed: {len(removed_events)}")
+
+    # Build events (malformed items are skipped; their IDs are still marked processed below)
+    new_events = []
+    for record in normalise_events(new_api_events, theatre):
+        logging.debug("  New event: %s on %s at %s", record.title, record.date, record.time)
+        new_events.append(record.to_dict())
+
+    metrics.incr('new_events', len(new_events))
+    metrics.incr('changed_events', len(changed_events))
+    metrics.incr('removed_events', len(removed_events))
+
+    updates = []
+    if changed_events and config.TCE_NOTIFY_CHANGES:
+        changes = {e['bk_id']: _describe_changes(old, e) for e, old in changed_events}
+        updates.append(('changed', [{**r.to_dict(), 'changes': changes[r.id]} for r in normalise_events(
+            [e for e, _ in changed_events], theatre)], {str(e['bk_id']): _event_hash(e) for e, _ in changed_events}))
+    if removed_events and config.TCE_NOTIFY_REMOVALS:
+        updates.append(('removed', [r.to_dict() for r in normalise_events(
+            [_api_event_from_index(bk_id, old) for bk_id, old in removed_events], theatre)],
+            {str(bk_id): old[0] for bk_id, old in removed_events}))
+
+    # Queue one notification per event (new first, then schedule changes) for drain_outbox()
+    notifications = []
+    if notify:
+        notifications = _outbox_items(new_events, 'new', use_test_channel, theatre)
+        for kind, events, versions in updates:
+            notifications += _outbox_items(events, kind, use_test_channel, theatre, versions)
+    elif new_events or updates:
         logging.info(f"  Skipping notification (--no-notify mode)")
 
-    # Step 5: persist updated processed IDs (all fetched, including already-seen)
-    save_processed_ids(processed_ids | fetched_ids)
+    # Store the events and queue their notifications in one transaction. If that fails the
+    # state is not advanced, so the next run classifies (and queues) the same events again
+    if (new_events or notifications) and save_tce_events(new_events, notifications) is None:
+        logging.error(f"[{name}] Events not stored — keeping the previous state for a retry")
+        return []
 
-    logging.info(f"Done. Found and notified {len(new_events)} new puppet theatre events")
+    # Persist updated processed IDs (all fetched, including already-seen), then the index;
+    # fingerprints last, since they let the next run skip these windows
+    if save_processed_ids(processed_ids | fetched_ids, state_file) and save_event_index(state_file, index):
+        save_fingerprints(state_file, current)
     return new_events
 
 
-def save_single_tce_event(event):
-    """Save a single TCE event to the database"""
+def check_for_new_tce_events(use_test_channel=False, notify=True, session=None, theatres=None,
+                             allow_partial=None, deliver=True) -> list:
+    """
+    Main entry point. Fetches events for every configured theatre (see load_theatres)
+    from the tce.by search API, processes only IDs not yet seen, queues their
+    notifications in the outbox, and persists each theatre's updated processed-ID set.
+    With `deliver` the outbox is drained at the end of the run; otherwise delivery is
+    left to a separate drain_outbox() caller (main.py --daemon worker, --drain-only).
+
+    Pass a TceBrowserSession to reuse a warm browser across calls (daemon mode).
+    A theatre with failed windows is left to the run checkpoint and not diffed, unless
+    `allow_partial` (default TCE_ALLOW_PARTIAL) is set.
+
+    Returns list of newly found event dicts.
+    """
+    run = metrics.start_run()
+    success = False
     try:
-        # Load existing events
-        existing_events = load_previous_tce_data()
+        theatres = theatres or load_theatres()
+        logging.info("=" * 60)
+        logging.info(f"Starting TCE.BY monitoring for {len(theatres)} theatre(s) (search-API mode)")
+        logging.info("=" * 60)
 
-        # Check if event already exists
-        event_exists = any(e['id'] == event['id'] for e in existing_events)
+        # Step 1: get every theatre's events from the search API (single browser session).
+        # Meanwhile the stream stage stores, queues and sends each window's new events
+        stream = _NotifyStream(theatres, use_test_channel) if notify and config.TCE_STREAM_NOTIFY else None
+        try:
+            windows_by_theatre = fetch_theatre_events(theatres, session=session,
+                                                      on_window=stream.put if stream else None)
+        finally:
+            if stream:
+                stream.close()
+                metrics.incr('streamed_events', stream.streamed)
+
+        # Step 2: per-theatre diff, build, queue notifications and persist (only once coverage is complete)
+        if allow_partial is None:
+            allow_partial = config.TCE_ALLOW_PARTIAL
+        new_events = []
+        for theatre in theatres:
+            windows = windows_by_theatre.get(theatre['name'], [])
+            if config.TCE_SNAPSHOTS and _is_complete(windows):
+                record_snapshot(theatre, windows)
+            if not _is_complete(windows):
+                if not allow_partial:
+                    logging.warning(f"[{theatre['name']}] Incomplete coverage — skipping diff; "
+                                    f"checkpoint saved, a re-run fetches only the missing windows")
+                    metrics.incr('partial_skipped')
+                    continue
+                logging.warning(f"[{theatre['name']}] Processing partial coverage (allow_partial)")
+            new_events.extend(_process_theatre_events(
+                theatre, windows, use_test_channel=use_test_channel, notify=notify,
+            ))
+            clear_checkpoint(theatre['state_file'])
 
-        if not event_exists:
-            existing_events.append(event)
-            save_tce_data(existing_events)
-            logging.info(f"Saved new TCE event ID {event['id']} to database")
+        # Step 3: deliver queued notifications. State is already persisted, so a failed send
+        # stays in the outbox for a later drain instead of being lost
+        if notify and deliver:
+            with metrics.phase('outbox_drain'):
+                drain_outbox()
+
+        logging.info(f"Done. Found {len(new_events)} new events")
+        success = True
+        return new_events
+    finally:
+        run.finish(success)
+
+
+def record_snapshot(theatre, windows):
+    """
+    Add this run's complete fetched set for the theatre to the snapshot history (see
+    snapshots.py). A fetch that stopped early, before the planned horizon end, is not
+    recorded. Best-effort: a failure is logged and does not affect the run.
+    """
+    horizon_end = _build_month_windows(months_ahead=theatre['months_ahead'])[-1]['date_end']
+    if not windows or max(w['date_end'] for w in windows) < horizon_end:
+        # Stopped early at an empty month: later shows were not fetched, not removed
+        logging.info(f"[{theatre['name']}] Fetch stopped before {horizon_end} — no snapshot this run")
+        metrics.incr('snapshot_skipped')
+        return None
+    events = {e['bk_id']: (_event_hash(e), dict(zip(_TRACKED_FIELDS, _index_entry(e)[1:])))
+              for e in _window_events(windows)}
+    try:
+        from snapshots import get_snapshot_store
+        with metrics.phase('snapshot', theatre=theatre['name'], events=len(events)):
+            run = get_snapshot_store().record(theatre['name'], events)
+        logging.info(f"[{theatre['name']}] Snapshot: {run['total']} event(s), +{run['added']} "
+                     f"-{run['removed']} ~{run['changed']}" + (" (checkpoint)" if run['checkpoint'] else ""))
+        return run
+    except Exception as e:
+        logging.warning(f"[{theatre['name']}] Could not record snapshot: {e}")
+        return None
+
+
+def _event_store():
+    from event_store import get_event_store
+    return get_event_store()
+
+
+def save_tce_events(events, notifications=()):
+    """
+    Store a batch of new TCE events and queue their outbox items in one transaction
+    (group commit). Returns how many events were new, or None if the write failed.
+    """
+    try:
+        with metrics.phase('store_write', events=len(events), notifications=len(notifications)):
+            inserted = _event_store().add_many(events, notifications)
+        logging.info(f"Saved {inserted} new TCE events to {config.TCE_EVENTS_DB}"
+                     + (f", queued {len(notifications)} notification(s)" if notifications else ""))
+        return inserted
+    except Exception as e:
+        logging.error(f"Error saving TCE events: {e}")
+        return None
+
+
+def save_single_tce_event(event):
+    """Save a single TCE event to the database"""
+    try:
+        if _event_store().add_many([event]):
+            logging.debug("Saved new TCE event ID %s to database", event['id'])
         else:
-            logging.info(f"TCE event ID {event['id']} already in database")
+            logging.debug("TCE event ID %s already in database", event['id'])
 
     except Exception as e:
         logging.error(f"Error saving single TCE event: {e}")
@@ -385,29 +1196,19 @@ def save_single_tce_event(event):
 
 def load_previous_tce_data():
     """Load previously saved TCE event data"""
-    if os.path.exists(config.TCE_DATA_FILE):
-        try:
-            with open(config.TCE_DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                logging.info(f"Successfully loaded {len(data)} TCE events from {config.TCE_DATA_FILE}")
-                return data
-        except Exception as e:
-            logging.error(f"Error loading previous TCE data: {e}")
-            return []
-    logging.info(f"No previous TCE data file exists")
-    return []
+    try:
+        data = _event_store().all()
+        logging.info(f"Successfully loaded {len(data)} TCE events from {config.TCE_EVENTS_DB}")
+        return data
+    except Exception as e:
+        logging.error(f"Error loading previous TCE data: {e}")
+        return []
 
 
 def save_tce_data(events):
-    """Save TCE event data"""
+    """Save TCE event data (replaces the stored events)"""
     try:
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(config.TCE_DATA_FILE), exist_ok=True)
-
-        with open(config.TCE_DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(events, f, ensure_ascii=False, indent=2)
-        logging.info(f"Successfully saved {len(events)} TCE events to {config.TCE_DATA_FILE}")
+        _event_store().replace_all(events)
+        logging.info(f"Successfully saved {len(events)} TCE events to {config.TCE_EVENTS_DB}")
     except Exception as e:
         logging.error(f"Error saving TCE data: {e}")
-
-
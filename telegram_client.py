@@ -0,0 +1,166 @@
+"""Pooled, rate-limited Telegram Bot API client used for channel notifications"""
+import json
+import logging
+import random
+from collections import deque
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Block until a token is available. Returns the time spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds: float) -> None:
+        """Drain the bucket and hold it for `seconds` (used when Telegram sends retry_after)."""
+        with self._lock:
+            self._tokens = -seconds * self.rate
+            self._updated = time.monotonic()
+
+
+class TelegramClient:
+    """
+    Bot API client with a keep-alive connection pool, a global and a per-chat token
+    bucket tuned to Telegram's limits, retry_after handling and bounded retries with
+    exponential backoff. Every call's latency and retry count is recorded in `stats`.
+    """
+
+    def __init__(self, bot_token=None):
+        self.bot_token = bot_token or config.TELEGRAM_BOT_TOKEN
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.TELEGRAM_POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._global = TokenBucket(config.TELEGRAM_GLOBAL_RATE, config.TELEGRAM_GLOBAL_RATE)
+        self._chats = {}
+        self._chats_lock = threading.Lock()
+        self.stats = deque(maxlen=1000)  # most recent delivery records
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        with self._chats_lock:
+            if chat_id not in self._chats:
+                self._chats[chat_id] = TokenBucket(config.TELEGRAM_CHAT_RATE_PER_MIN / 60.0,
+                                                   config.TELEGRAM_CHAT_BURST)
+            return self._chats[chat_id]
+
+    def call(self, method: str, payload: dict, files=None) -> dict:
+        """
+        Call a Bot API method, respecting rate limits and retrying 429/5xx/network errors.
+        `files` ({field: (filename, bytes, mime type)}) switches to a multipart upload.
+        Returns a delivery record: ok, status, description, result, latency, retries.
+        """
+        url = f"{config.TELEGRAM_API_URL}/bot{self.bot_token}/{method}"
+        bucket = self._chat_bucket(payload.get('chat_id'))
+        started = time.monotonic()
+        record = {'method': method, 'chat_id': payload.get('chat_id'), 'ok': False, 'status': None,
+                  'description': None, 'result': None, 'retries': 0}
+
+        for attempt in range(config.TELEGRAM_MAX_RETRIES + 1):
+            record['retries'] = attempt
+            bucket.acquire()
+            self._global.acquire()
+            retry_delay = None
+            try:
+                if files:
+                    form = {k: json.dumps(v) if isinstance(v, (list, dict)) else v for k, v in payload.items()}
+                    response = self.session.post(url, data=form, files=files, timeout=60)
+                else:
+                    response = self.session.post(url, json=payload, timeout=10)
+                record['status'] = response.status_code
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = {'description': response.text}
+                record['description'] = body.get('description')
+                if response.ok and body.get('ok', True):
+                    record['ok'] = True
+                    record['result'] = body.get('result')
+                    break
+                if response.status_code == 429:
+                    retry_after = float((body.get('parameters') or {}).get('retry_after', 1))
+                    bucket.pause(retry_after)  # the next acquire() waits it out
+                    retry_delay = 0.0
+                    logging.warning(f"Telegram rate limit on {method}: retry after {retry_after:.0f}s")
+                elif response.status_code >= 500:
+                    retry_delay = config.TELEGRAM_BACKOFF_BASE * (2 ** attempt)
+                else:
+                    break  # 4xx other than 429 will not succeed on retry
+            except requests.exceptions.RequestException as e:
+                record['description'] = str(e)
+                retry_delay = config.TELEGRAM_BACKOFF_BASE * (2 ** attempt)
+
+            if attempt < config.TELEGRAM_MAX_RETRIES:
+                time.sleep(retry_delay + random.uniform(0, 0.25))
+
+        record['started'] = started
+        record['latency'] = time.monotonic() - started
+        self.stats.append(record)
+        return record
+
+    def send_message(self, chat_id, text: str, **params) -> dict:
+        return self.call('sendMessage', {'chat_id': chat_id, 'text': text, **params})
+
+    def send_photo(self, chat_id, photo, files=None, **params) -> dict:
+        """`photo` is a file_id, or None when the file is uploaded as files['photo']."""
+        payload = {'chat_id': chat_id, **params}
+        if photo is not None:
+            payload['photo'] = photo
+        return self.call('sendPhoto', payload, files=files)
+
+    def send_media_group(self, chat_id, media: list, files=None, **params) -> dict:
+        """Album of 2–10 InputMediaPhoto dicts; uploads are referenced as 'attach://<field>'."""
+        return self.call('sendMediaGroup', {'chat_id': chat_id, 'media': media, **params}, files=files)
+
+    def summary(self, since=None) -> dict:
+        """
+        Aggregate delivery stats (sent/failed counts, total retries, max and mean latency)
+        over the recorded calls, or only those started at/after the time.monotonic() value `since`.
+        """
+        records = [r for r in self.stats if since is None or r['started'] >= since]
+        if not records:
+            return {'sent': 0, 'failed': 0, 'retries': 0, 'max_latency': 0.0, 'mean_latency': 0.0}
+        latencies = [r['latency'] for r in records]
+        return {
+            'sent': sum(1 for r in records if r['ok']),
+            'failed': sum(1 for r in records if not r['ok']),
+            'retries': sum(r['retries'] for r in records),
+            'max_latency': max(latencies),
+            'mean_latency': sum(latencies) / len(latencies),
+        }
+
+
+_client = None
+
+
+def get_telegram_client() -> TelegramClient:
+    """Process-wide client so the connection pool and rate limiters are shared across sends."""
+    global _client
+    if _client is None or _client.bot_token != config.TELEGRAM_BOT_TOKEN:
+        _client = TelegramClient()
+    return _client